@@ -0,0 +1,66 @@
+# (C) Copyright 2017- ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation
+# nor does it submit to any jurisdiction.
+
+"""
+Measures the speedup of the per-field Fieldset operations with the number of
+workers of the executor.
+
+    METVIEW_PYTHON_ONLY=1 python benchmarks/bench_executor.py [--kind thread|process]
+"""
+
+import argparse
+import os
+import time
+
+from metview.metviewpy import executor
+from metview.metviewpy.fieldset import Fieldset
+
+PATH = os.path.join(os.path.dirname(__file__), "..", "tests", "test.grib")
+
+
+def make_fieldset(n):
+    fs = Fieldset(path=PATH)
+    res = Fieldset()
+    for i in range(n):
+        res.append(fs + i)
+    return res
+
+
+def run(fs):
+    start = time.perf_counter()
+    r = (fs * 2 + 1).sqrt()
+    r = r.coslat()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fields", type=int, default=64)
+    parser.add_argument("--kind", default="thread", choices=["thread", "process"])
+    parser.add_argument("--chunk-size", type=int, default=1)
+    args = parser.parse_args()
+
+    fs = make_fieldset(args.fields)
+    print(f"{len(fs)} fields, kind={args.kind}, chunk_size={args.chunk_size}")
+
+    executor.set_executor()
+    t_ref = run(fs)
+    print(f"serial     {t_ref:8.3f}s")
+
+    n = 1
+    while n <= os.cpu_count():
+        executor.set_executor(kind=args.kind, max_workers=n, chunk_size=args.chunk_size)
+        t = run(fs)
+        print(f"workers={n:<3} {t:8.3f}s  speedup={t_ref / t:5.2f}")
+        n *= 2
+    executor.set_executor()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+# (C) Copyright 2017- ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation
+# nor does it submit to any jurisdiction.
+
+"""
+Measures writing and reading the index blocks in each storage format on
+synthetic indexes.
+
+    METVIEW_PYTHON_ONLY=1 python benchmarks/bench_index_storage.py [--rows 1000000]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from metview.metviewpy.indexer import INDEX_STORAGES, ExperimentIndexer
+
+from bench_vector_index import make_index
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000000)
+    args = parser.parse_args()
+
+    df = make_index(ExperimentIndexer(object()), args.rows)
+    df["_fileIndex1"] = df["_msgIndex1"] // 1000
+    print(f"{len(df)} rows")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, storage in INDEX_STORAGES.items():
+            path = storage.path("scalar", tmp_dir)
+            start = time.perf_counter()
+            storage.write(df, path)
+            t_write = time.perf_counter() - start
+
+            start = time.perf_counter()
+            r = storage.read(path)
+            t_read = time.perf_counter() - start
+            assert r.equals(df)
+
+            start = time.perf_counter()
+            storage.read(path, columns=["shortName", "level", "step"])
+            t_proj = time.perf_counter() - start
+            print(
+                f"  {name:<4} write={t_write:7.3f}s  read={t_read:7.3f}s  "
+                f"read 3 columns={t_proj:7.3f}s  "
+                f"size={os.path.getsize(path) / 1024**2:7.1f}MB"
+            )
+
+
+if __name__ == "__main__":
+    main()
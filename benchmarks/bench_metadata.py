@@ -0,0 +1,107 @@
+# (C) Copyright 2017- ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation
+# nor does it submit to any jurisdiction.
+
+"""
+Compares the bulk metadata reader with the former per-key get_any() loop
+when reading the default indexer keys from many GRIB messages.
+
+    METVIEW_PYTHON_ONLY=1 python benchmarks/bench_metadata.py [--messages 100000]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import eccodes
+
+from metview.metviewpy import metadata
+from metview.metviewpy.fieldset import CodesHandle, Fieldset
+from metview.metviewpy.indexer import GribIndexer
+
+PATH = os.path.join(os.path.dirname(__file__), "..", "tests", "tuv_pl.grib")
+
+
+def make_file(n):
+    with open(PATH, "rb") as f:
+        data = f.read()
+    num = len(Fieldset(path=PATH))
+    fd, path = tempfile.mkstemp(suffix=".grib")
+    with os.fdopen(fd, "wb") as f:
+        for _ in range(n // num):
+            f.write(data)
+    return path
+
+
+def legacy_get_any(handle, keys):
+    # the former implementation of CodesHandle.get_any for a list of keys
+    result = []
+    for key in keys:
+        key_type_str = "s"
+        parts = key.split(":")
+        if len(parts) == 2:
+            key, key_type_str = parts
+            if key_type_str == "n" and eccodes.codes_get_size(handle, key) > 1:
+                key_type_str = "na"
+        func = CodesHandle._STR_TYPES.get(key_type_str, None)[0]
+        try:
+            result.append(func(handle, key))
+        except Exception:
+            result.append(None)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=100000)
+    args = parser.parse_args()
+
+    keys = GribIndexer.DEFAULT_ECC_KEYS
+    path = make_file(args.messages)
+    try:
+        fs = Fieldset(path=path)
+        handles = [f.handle.handle for f in fs.fields]
+        print(f"{len(handles)} messages, {len(keys)} keys")
+
+        start = time.perf_counter()
+        rows = [legacy_get_any(h, keys) for h in handles]
+        list(map(list, zip(*rows)))
+        t_ref = time.perf_counter() - start
+        print(f"legacy get_any      {t_ref:8.3f}s")
+
+        start = time.perf_counter()
+        metadata.reader(keys).read_handles(handles)
+        t = time.perf_counter() - start
+        print(f"reader              {t:8.3f}s  speedup={t_ref / t:5.2f}")
+
+        start = time.perf_counter()
+        metadata.reader(keys).read_handles(handles, as_numpy=True)
+        t = time.perf_counter() - start
+        print(f"reader (numpy)      {t:8.3f}s  speedup={t_ref / t:5.2f}")
+
+        # the cost of the individual keys
+        for s in metadata.reader(keys).specs:
+            start = time.perf_counter()
+            for h in handles:
+                s.get(h)
+            t = time.perf_counter() - start
+            print(f"  {s.spec:<28} {t / len(handles) * 1e6:8.1f}us/message")
+
+        fs = None
+        handles = None
+        start = time.perf_counter()
+        metadata.reader(keys).read_file(path, headers_only=True)
+        t = time.perf_counter() - start
+        print(f"reader (file, hdr)  {t:8.3f}s  includes reading the file")
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
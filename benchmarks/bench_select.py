@@ -0,0 +1,102 @@
+# (C) Copyright 2017- ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation
+# nor does it submit to any jurisdiction.
+
+"""
+Compares the boolean mask and the inverted index filtering of the index with
+the former DataFrame.query() based one on synthetic indexes.
+
+    METVIEW_PYTHON_ONLY=1 python benchmarks/bench_select.py [--rows 1000000]
+"""
+
+import argparse
+import datetime
+import time
+
+from metview.metviewpy import indexdb
+from metview.metviewpy.indexdb import IndexDb, MASK_CACHE
+from metview.metviewpy.indexer import FieldsetIndexer
+
+from bench_vector_index import make_index
+
+FILTERS = {
+    "shortName": {"shortName": ["u"]},
+    "level+step": {"shortName": ["u"], "level": [500, 850], "step": [0, 6, 12]},
+    "dateTime": {
+        "_dateTime": [datetime.datetime(2022, 1, 1, 0, 0)] * 4,
+        "date": [],
+        "time": [],
+    },
+}
+
+
+def legacy_filter(db, df, dims):
+    # the former query string based filtering
+    q = ""
+    for column, v in dims.items():
+        if v:
+            if q:
+                q += " and "
+            if column == "_dateTime":
+                s = [
+                    f"(`date` == {int(x.strftime('%Y%m%d'))} and "
+                    + f"`time` == {int(x.strftime('%H%M'))})"
+                    for x in v
+                ]
+                q += "(" + " or ".join(s) + " ) "
+            else:
+                q += f"`{column}` in {v}"
+    return df.query(q, engine="python").reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    df = make_index(FieldsetIndexer(object()), args.rows)
+    db = IndexDb("bench")
+    print(f"{len(df)} rows")
+    for name, dims in FILTERS.items():
+        start = time.perf_counter()
+        ref = legacy_filter(db, df, dims)
+        t_ref = time.perf_counter() - start
+
+        MASK_CACHE.clear()
+        start = time.perf_counter()
+        r = db._filter_df(df=df, dims=dims)
+        t_first = time.perf_counter() - start
+        assert r.equals(ref)
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            db._filter_df(df=df, dims=dims)
+        t = (time.perf_counter() - start) / args.repeat
+        print(
+            f"  {name:<12} query={t_ref:7.3f}s  mask={t_first:7.3f}s  "
+            f"cached={t:7.3f}s  rows={len(r)}"
+        )
+
+    indexdb.INVERTED_INDEX = True
+    MASK_CACHE.clear()
+    start = time.perf_counter()
+    db._inverted_index("bench", df)
+    print(f"  inverted index built in {time.perf_counter() - start:7.3f}s")
+    for name, dims in FILTERS.items():
+        r = db._filter_df(df=df, dims=dims, key="bench")
+        assert r.equals(db._filter_df(df=df, dims=dims))
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            db._filter_df(df=df, dims=dims, key="bench")
+        t = (time.perf_counter() - start) / args.repeat
+        print(f"  {name:<12} inverted={t * 1000:8.3f}ms  rows={len(r)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# (C) Copyright 2017- ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation
+# nor does it submit to any jurisdiction.
+
+"""
+Compares the extraction of the selected or sorted fields with take() with
+the former row by row append() on synthetic indexes. The Fields are
+placeholders since only the bookkeeping is measured. The former
+implementation is quadratic so it is only timed up to --legacy-max rows.
+
+    METVIEW_PYTHON_ONLY=1 python benchmarks/bench_take.py [--rows 10000 100000]
+"""
+
+import argparse
+import time
+
+from metview.metviewpy.fieldset import Fieldset
+from metview.metviewpy.indexdb import FieldsetDb
+
+from bench_vector_index import make_index
+
+
+def legacy_extract_scalar_fields(db, df):
+    # the former implementation of FieldsetDb._extract_scalar_fields
+    fs = db.fieldset_class()
+    for row in df.itertuples():
+        fs.append(db.fs[row[-1]])
+    df = df.copy()
+    df["_msgIndex1"] = list(range(len(df.index)))
+    return df, fs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--legacy-max", type=int, default=30000)
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        db = FieldsetDb(Fieldset(fields=[object() for _ in range(rows)]))
+        df = make_index(db.indexer, rows)
+        df = db.indexer._sort_dataframe(df, columns=["level", "step"])
+        print(f"{len(df)} rows")
+
+        start = time.perf_counter()
+        r, fs = db._extract_scalar_fields(df)
+        t = time.perf_counter() - start
+        print(f"  take    {t:8.3f}s")
+
+        start = time.perf_counter()
+        c = FieldsetDb(Fieldset(), blocks={"scalar": df.copy()})
+        db._extract_fields(df, c.fs, -1)
+        print(f"  select  {time.perf_counter() - start:8.3f}s")
+
+        if rows <= args.legacy_max:
+            start = time.perf_counter()
+            r_ref, fs_ref = legacy_extract_scalar_fields(db, df)
+            t_ref = time.perf_counter() - start
+            print(f"  legacy  {t_ref:8.3f}s  speedup={t_ref / t:7.1f}")
+            assert fs.fields == fs_ref.fields
+            assert r.equals(r_ref)
+
+
+if __name__ == "__main__":
+    main()
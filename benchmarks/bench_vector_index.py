@@ -0,0 +1,104 @@
+# (C) Copyright 2017- ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation
+# nor does it submit to any jurisdiction.
+
+"""
+Measures the pairing of the wind components in the indexer on synthetic
+indexes. The former nested loop implementation is only timed up to
+--legacy-max rows since it is quadratic.
+
+    METVIEW_PYTHON_ONLY=1 python benchmarks/bench_vector_index.py [--rows 10000 100000 1000000]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from metview.metviewpy.indexer import GribIndexer, FieldsetIndexer
+
+
+def make_index(indexer, rows, comps=("u", "v", "w"), seed=1):
+    """Creates a synthetic scalar index with rows messages of comps"""
+    rng = np.random.default_rng(seed)
+    n = rows // len(comps)
+    levels = [1000, 925, 850, 700, 500, 400, 300, 250, 200, 150, 100]
+    steps = np.arange(n) // len(levels)
+    data = {k: [] for k in [*indexer.keys, "_msgIndex1"]}
+    for name in comps:
+        # the components are stored in a random order
+        order = rng.permutation(n)
+        for k, v in GribIndexer.DEFAULT_KEYS.items():
+            data[k].extend([v[2](0)] * n)
+        data["shortName"][-n:] = [name] * n
+        data["date"][-n:] = [20220101] * n
+        data["step"][-n:] = list(steps[order])
+        data["level"][-n:] = [levels[i % len(levels)] for i in order]
+        data["_msgIndex1"].extend(
+            range(len(data["_msgIndex1"]), len(data["shortName"]))
+        )
+    return indexer._make_dataframe(data)
+
+
+def legacy_build_vector_index(indexer, df, v_name, v_comp):
+    # the former nested loop implementation, 2D only
+    comp_df = [df[df["shortName"] == c].copy() for c in v_comp]
+    r = []
+    used1 = np.full(len(comp_df[1].index), False, dtype="?")
+    comp_df[0].loc[:, "shortName"] = v_name
+    for row0 in comp_df[0].itertuples(name=None):
+        i = 0
+        for row1 in comp_df[1].itertuples(name=None):
+            if not used1[i]:
+                b = True
+                for x in indexer.wind_check_index:
+                    if row0[x] != row1[x]:
+                        b = False
+                        break
+                if b:
+                    d = list(row0[1:])
+                    d.extend(row1[-indexer.ref_column_count :])
+                    r.append(d)
+                    used1[i] = True
+                    break
+            i += 1
+    return r
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--legacy-max", type=int, default=10000)
+    args = parser.parse_args()
+
+    indexer = FieldsetIndexer(object())
+    for rows in args.rows:
+        df = make_index(indexer, rows)
+        print(f"{len(df)} rows")
+
+        start = time.perf_counter()
+        r2 = indexer._build_vector_index(df, "wind", ["u", "v"])
+        print(
+            f"  wind    hash join {time.perf_counter() - start:8.3f}s  pairs={len(r2)}"
+        )
+
+        start = time.perf_counter()
+        r3 = indexer._build_vector_index(df, "wind3d", ["u", "v", "w"])
+        print(
+            f"  wind3d  hash join {time.perf_counter() - start:8.3f}s  pairs={len(r3)}"
+        )
+
+        if rows <= args.legacy_max:
+            start = time.perf_counter()
+            r = legacy_build_vector_index(indexer, df, "wind", ["u", "v"])
+            print(f"  wind    legacy    {time.perf_counter() - start:8.3f}s")
+            assert r == r2
+
+
+if __name__ == "__main__":
+    main()
@@ -22,6 +22,7 @@ import numpy as np
 from numpy.lib.arraysetops import _setxor1d_dispatcher, isin
 
 from metview.metviewpy.indexdb import FieldsetDb
+from metview.metviewpy.fieldset import GribFile
 from metview.dataset import Dataset
 from metview.style import (
     GeoView,
@@ -697,6 +698,48 @@ class Fieldset(FileBackedValueWithOperators, ContainerValue):
         self.steal_val_pointer(temp)
         self._db = None
 
+    def view(self):
+        """Returns a new Fieldset with the same fields and index as this one"""
+        r = Fieldset(fields=[self])
+        r._db = self._db
+        return r
+
+    @staticmethod
+    def from_refs(refs):
+        """
+        Creates a Fieldset from (path, offset, length) message references. Only
+        these byte ranges are copied into a temporary file, which is deleted by
+        Metview when no longer needed.
+        """
+        f, tmp = tempfile.mkstemp(".grib")
+        files = {}
+        try:
+            with os.fdopen(f, "wb") as fout:
+                i = 0
+                while i < len(refs):
+                    path, offset, length = refs[i]
+                    # the run of messages stored next to each other
+                    i += 1
+                    while (
+                        i < len(refs)
+                        and refs[i][0] == path
+                        and refs[i][1] == offset + length
+                    ):
+                        length += refs[i][2]
+                        i += 1
+                    if path not in files:
+                        files[path] = open(path, "rb")
+                    GribFile.copy_bytes(files[path], fout, offset, length)
+        except Exception:
+            os.remove(tmp)
+            raise
+        finally:
+            for fin in files.values():
+                fin.close()
+        fs = read(tmp)
+        fs.set_temporary(1)
+        return fs
+
     def to_dataset(self, **kwarg):
         # soft dependency on cfgrib
         try:
@@ -1489,6 +1532,7 @@ class Plot:
 
 plot = Plot()
 
+
 # animate - only usable within Jupyter notebooks
 # generates a widget allowing the user to select between plot frames
 def plot_to_notebook(*args, **kwargs):  # pragma: no cover
@@ -1515,7 +1559,7 @@ def plot_to_notebook(*args, **kwargs):  # pragma: no cover
         )
     )
     met_plot(*args)
-    (_, _, filenames) = next(os.walk(tempdirpath), (None, None, None))
+    _, _, filenames = next(os.walk(tempdirpath), (None, None, None))
 
     if filenames is None:
         waitl_widget.value = "No plots generated"
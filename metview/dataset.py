@@ -83,11 +83,11 @@ class ExperimentDb(IndexDb):
             self._indexer = ExperimentIndexer(self)
         return self._indexer
 
-    def scan(self, vector=True):
+    def scan(self, vector=True, incremental=True, workers=None, progress=None):
         print(f"Generate index for dataset component={self.name} ...")
         self.data_files = []
         # self.blocks = {}
-        self.indexer.scan()
+        self.indexer.scan(incremental=incremental, workers=workers, progress=progress)
 
     def load(self, keys=None, vector=True):
         keys = [] if keys is None else keys
@@ -103,6 +103,7 @@ class ExperimentDb(IndexDb):
             self.load_data_file_list()
 
         if len(self.blocks) == 0:
+            ExperimentIndexer.migrate_storage(self.db_dir)
             for key in ExperimentIndexer.get_storage_key_list(self.db_dir):
                 self.blocks[key] = ExperimentIndexer.read_dataframe(key, self.db_dir)
 
@@ -142,7 +143,7 @@ class ExperimentDb(IndexDb):
             # LOG.debug(f"key={key}")
             # df = self._load_block(key)
             # LOG.debug(f"df={df}")
-            f_df = self._filter_df(df=df, dims=dims)
+            f_df = self._filter_df(df=df, dims=dims, key=key)
             # LOG.debug(f"df={df}"
             if f_df is not None and not f_df.empty:
                 cnt += len(f_df)
@@ -167,19 +168,65 @@ class ExperimentDb(IndexDb):
 
         idx = [[] for k in range(comp_num)]
         comp_lst = list(range(comp_num))
+        # the positions in the rows, which start with the index
+        pos = [
+            (
+                df.columns.get_loc(f"_fileIndex{comp+1}") + 1,
+                df.columns.get_loc(f"_msgIndex{comp+1}") + 1,
+            )
+            for comp in comp_lst
+        ]
+        # with the message locations in the index only the selected messages
+        # are read, otherwise the whole data files are loaded
+        refs = []
+        if (
+            "_offset1" in df.columns
+            and getattr(self.fieldset_class, "from_refs", None) is not None
+        ):
+            loc = [
+                (
+                    df.columns.get_loc(f"_offset{comp+1}") + 1,
+                    df.columns.get_loc(f"_length{comp+1}") + 1,
+                )
+                for comp in comp_lst
+            ]
+        else:
+            loc = None
+        start = len(fs)
         for row in df.itertuples():
             for comp in comp_lst:
-                idx_file = row[-1 - (comp_num - comp - 1) * 2]
-                idx_msg = row[-2 - (comp_num - comp - 1) * 2]
+                idx_file = row[pos[comp][0]]
+                if loc is not None:
+                    refs.append(
+                        (
+                            self.data_files[idx_file],
+                            int(row[loc[comp][0]]),
+                            int(row[loc[comp][1]]),
+                        )
+                    )
+                    idx[comp].append(start + len(refs) - 1)
+                    continue
+                idx_msg = row[pos[comp][1]]
                 if not idx_file in self.fs:
                     self.fs[idx_file] = mv.read(self.data_files[idx_file])
                 fs.append(self.fs[idx_file][idx_msg])
                 idx[comp].append(len(fs) - 1)
+        if refs:
+            fs.append(self.fieldset_class.from_refs(refs))
         # generate a new dataframe
         df = df.copy()
         for k, v in enumerate(idx):
             df[f"_msgIndex{k+1}"] = v
-        df.drop([f"_fileIndex{x+1}" for x in range(comp_num)], axis=1, inplace=True)
+        df.drop(
+            [
+                f"{c}{x+1}"
+                for x in range(comp_num)
+                for c in ExperimentIndexer.REF_COLUMNS[1:]
+                if f"{c}{x+1}" in df.columns
+            ],
+            axis=1,
+            inplace=True,
+        )
         return df
 
     def to_fieldset(self):
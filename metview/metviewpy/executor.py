@@ -0,0 +1,104 @@
+# (C) Copyright 2017- ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation
+# nor does it submit to any jurisdiction.
+#
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import logging
+import os
+
+LOG = logging.getLogger(__name__)
+
+
+class FieldExecutor:
+    """
+    Runs a function on each item of a sequence either serially, in a thread
+    pool or in a process pool. The items are dispatched in chunks of
+    chunk_size and the results always follow the order of the items.
+
+    In a process pool the function and the items must be picklable. A thread
+    pool is only useful when ecCodes was built with thread support.
+    """
+
+    KINDS = ["serial", "thread", "process"]
+
+    def __init__(self, kind="serial", max_workers=None, chunk_size=1):
+        if kind not in FieldExecutor.KINDS:
+            raise ValueError(
+                f"FieldExecutor: kind must be one of {FieldExecutor.KINDS}, not {kind}"
+            )
+        if chunk_size < 1:
+            raise ValueError(
+                f"FieldExecutor: chunk_size must be >= 1, not {chunk_size}"
+            )
+        self.kind = kind
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self._pool = None
+
+    def __str__(self):
+        return f"{self.__class__.__name__}[kind={self.kind}, max_workers={self.max_workers}, chunk_size={self.chunk_size}]"
+
+    @property
+    def batch_size(self):
+        """The number of items worth dispatching in one map call"""
+        if self.kind == "serial":
+            return 1
+        return self.chunk_size * (self.max_workers or os.cpu_count())
+
+    def _get_pool(self):
+        if self._pool is None:
+            if self.kind == "thread":
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._pool
+
+    def map(self, func, *iterables):
+        return list(self.imap(func, *iterables))
+
+    def imap(self, func, *iterables):
+        """Like map() but yields the results in order as they become available"""
+        items = list(zip(*iterables))
+        if self.kind == "serial" or len(items) < 2:
+            for args in items:
+                yield func(*args)
+            return
+
+        chunks = [
+            items[i : i + self.chunk_size]
+            for i in range(0, len(items), self.chunk_size)
+        ]
+        for r in self._get_pool().map(_run_chunk, [func] * len(chunks), chunks):
+            yield from r
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+def _run_chunk(func, chunk):
+    return [func(*args) for args in chunk]
+
+
+EXECUTOR = FieldExecutor()
+
+
+def set_executor(kind="serial", max_workers=None, chunk_size=1):
+    """Sets the executor used for the per-field operations"""
+    global EXECUTOR
+    EXECUTOR.shutdown()
+    EXECUTOR = FieldExecutor(kind=kind, max_workers=max_workers, chunk_size=chunk_size)
+    LOG.debug(f"executor={EXECUTOR}")
+    return EXECUTOR
+
+
+def map_fields(func, *iterables):
+    """Calls func for each item of iterables using the current executor"""
+    return EXECUTOR.map(func, *iterables)
@@ -8,21 +8,73 @@
 # nor does it submit to any jurisdiction.
 
 
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import partial
 from inspect import signature
+from itertools import repeat
+import mmap
+import os
+import pickle
 import sys
+import threading
+import weakref
 
 import numpy as np
 import eccodes
 
 from . import maths
+from . import metadata
+from . import reduction
+from . import executor
+from .executor import map_fields
+from .geometry import GEOMETRY_CACHE
 from .temporary import temp_file
 
 from . import indexdb as indexdb
+from .indexer import GribIndexer
+from .sidecar import SidecarIndex
 from . import utils
 
-
 BITS_PER_VALUE_FOR_WRITING = 24
 
+# read the messages of lazily loaded Fields from memory-mapped files
+READ_WITH_MMAP = True
+
+# buffer size used when messages cannot be copied with copy_file_range()
+COPY_BUFFER_SIZE = 16 * 1024 * 1024
+
+# when enabled Fields stored in a (non-temporary) file are pickled as a
+# (path, offset, length) reference instead of their message. Only use it when
+# the receiving processes can read the same files.
+PICKLE_BY_REFERENCE = False
+
+# when enabled the maths operators build an expression tree instead of
+# computing, encoding and writing the result of each operator
+LAZY_EVALUATION = False
+
+
+# when enabled the Fields cache the values of the scalar keys read from their
+# handle, see metadata.CACHE_STATS for the number of ecCodes calls saved
+METADATA_CACHE = True
+
+# when enabled the computed Fields keep their handle and values in memory
+# instead of being written into a temporary file. RESULT_MEMORY spills them
+# to disk when their total size exceeds its limit.
+MEMORY_RESULTS = False
+
+
+@contextmanager
+def lazy_evaluation(enable=True):
+    """Enables the deferred evaluation of the maths operators within a block"""
+    global LAZY_EVALUATION
+    prev = LAZY_EVALUATION
+    LAZY_EVALUATION = enable
+    try:
+        yield
+    finally:
+        LAZY_EVALUATION = prev
+
 
 class CodesHandle:
     """Wraps an ecCodes handle"""
@@ -46,10 +98,16 @@ class CodesHandle:
         for v in [STRING, LONG, DOUBLE, LONG_ARRAY, DOUBLE_ARRAY, NATIVE, NATIVE_ARRAY]
     }
 
-    def __init__(self, handle, path, offset):
+    def __init__(self, handle, path, offset, message_offset=None):
         self.handle = handle
         self.path = path
         self.offset = offset
+        # where the message starts in the file, offset can be the end of the
+        # previous message when the messages are padded
+        self.message_offset = offset if message_offset is None else message_offset
+        # the size, modification time and inode of the file when the message
+        # was read, None when unknown
+        self.fingerprint = None
         eccodes.codes_set(handle, "missingValue", CodesHandle.MISSING_VALUE)
 
     def __del__(self):
@@ -80,22 +138,9 @@ class CodesHandle:
             assert isinstance(keys, str)
             func = key_type[1]
             return func(self.handle, keys)
-        # list of keys
+        # list of keys, parsed only once by the cached reader
         else:
-            result = []
-            for key in keys:
-                key_type_str = "s"
-                parts = key.split(":")
-                if len(parts) == 2:
-                    key, key_type_str = parts
-                    if (
-                        key_type_str == "n"
-                        and eccodes.codes_get_size(self.handle, key) > 1
-                    ):
-                        key_type_str = "na"
-                func = CodesHandle._STR_TYPES.get(key_type_str, None)[0]
-                result.append(self.call_get_func(func, key, default=None))
-            return result
+            return metadata.reader(keys).get(self.handle)
 
     def get_string(self, key):
         return eccodes.codes_get_string(self.handle, key)
@@ -112,8 +157,14 @@ class CodesHandle:
     def get_double_array(self, key):
         return eccodes.codes_get_double_array(self.handle, key)
 
-    def get_values(self):
-        vals = eccodes.codes_get_values(self.handle)
+    def get_values(self, dtype=None):
+        # float32 values are decoded directly when ecCodes supports it
+        if dtype == np.float32 and hasattr(eccodes, "codes_get_float_array"):
+            vals = eccodes.codes_get_float_array(self.handle, "values")
+        else:
+            vals = eccodes.codes_get_values(self.handle)
+            if dtype is not None:
+                vals = vals.astype(dtype, copy=False)
         if self.get_long("bitmapPresent"):
             vals[vals == CodesHandle.MISSING_VALUE] = np.nan
         return vals
@@ -152,6 +203,9 @@ class CodesHandle:
 
     def write(self, fout, path):
         self.offset = fout.tell()
+        self.message_offset = self.offset
+        # only known once the file is complete
+        self.fingerprint = None
         eccodes.codes_write(self.handle, fout)
         if path:
             self.path = path
@@ -163,6 +217,7 @@ class GribFile:
     def __init__(self, path):
         self.path = path
         self.file = open(path, "rb")
+        self.fingerprint = GribFile.stat(path)
         self.num_messages = eccodes.codes_count_in_file(self.file)
 
     def __del__(self):
@@ -189,53 +244,569 @@ class GribFile:
         handle = eccodes.codes_new_from_file(self.file, eccodes.CODES_PRODUCT_GRIB)
         if not handle:
             return None
-        return CodesHandle(handle, self.path, offset)
+        handle = CodesHandle(
+            handle, self.path, offset, eccodes.codes_get_message_offset(handle)
+        )
+        handle.fingerprint = self.fingerprint
+        return handle
+
+    @staticmethod
+    def stat(path):
+        """Returns the size, modification time and inode of path or None if it
+        does not exist"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_size, st.st_mtime_ns, st.st_ino)
+
+    @staticmethod
+    def scan_offsets(path):
+        """Returns the (offset, length) of each message without creating handles"""
+        return list(
+            eccodes.codes_extract_offsets_sizes(path, eccodes.CODES_PRODUCT_GRIB)
+        )
+
+    @staticmethod
+    def scan_headers(path, keys):
+        """Returns the offset, length and the header values of keys for each
+        message. The data section of the messages is not loaded."""
+        return metadata.reader(keys).read_file(path, headers_only=True)
+
+    @staticmethod
+    def load_sidecar(path):
+        """Returns the sidecar index of path, creating it when needed"""
+        idx = SidecarIndex.load(path)
+        if idx is None:
+            idx = SidecarIndex(path, *GribFile.scan_headers(path, SidecarIndex.KEYS))
+            idx.write()
+        return idx
+
+    @staticmethod
+    def copy_bytes(fin, fout, offset, length):
+        """Copies length bytes from offset of fin to the current position of
+        fout. copy_file_range() is used when available so the data does not
+        pass through user space."""
+        fout.flush()
+        pos = fout.tell()
+        done = 0
+        if hasattr(os, "copy_file_range"):
+            try:
+                while done < length:
+                    n = os.copy_file_range(
+                        fin.fileno(),
+                        fout.fileno(),
+                        length - done,
+                        offset + done,
+                        pos + done,
+                    )
+                    if n == 0:
+                        break
+                    done += n
+            except OSError:
+                # e.g. not supported by the filesystem
+                pass
+        fin.seek(offset + done)
+        fout.seek(pos + done)
+        while done < length:
+            n = length - done
+            data = fin.read(COPY_BUFFER_SIZE if n > COPY_BUFFER_SIZE else n)
+            if not data:
+                raise EOFError(f"Unexpected end of file={fin.name}")
+            fout.write(data)
+            done += len(data)
+
+    @staticmethod
+    def load_handle(path, offset, length):
+        if READ_WITH_MMAP:
+            return MappedGribFile.get(path).handle(offset, length)
+        fingerprint = GribFile.stat(path)
+        data = FILE_POOL.read(path, offset, length)
+        handle = CodesHandle(eccodes.codes_new_from_message(data), path, offset)
+        handle.fingerprint = fingerprint
+        return handle
+
+
+class MappedGribFile:
+    """A read-only memory mapping of a GRIB file. Handles are created from
+    slices of the mapping so accessing a message does not need a seek and read
+    and the pages are shared with other processes via the page cache.
+    """
+
+    MAX_MAPPED_FILES = 64
+    _files = OrderedDict()
+    _lock = threading.Lock()
+
+    def __init__(self, path, fingerprint):
+        self.path = path
+        self.fingerprint = fingerprint
+        with open(path, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buffer = memoryview(self.mmap)
+
+    def handle(self, offset, length):
+        # ecCodes makes its own copy of the message from the mapped pages
+        handle = eccodes.codes_new_from_message(self.buffer[offset : offset + length])
+        handle = CodesHandle(handle, self.path, offset)
+        handle.fingerprint = self.fingerprint
+        return handle
+
+    @staticmethod
+    def get(path):
+        """Returns the mapping of path, remapping it when the file changed"""
+        st = os.stat(path)
+        fingerprint = (st.st_size, st.st_mtime_ns, st.st_ino)
+        files = MappedGribFile._files
+        with MappedGribFile._lock:
+            f = files.get(path)
+            if f is None or f.fingerprint != fingerprint:
+                f = MappedGribFile(path, fingerprint)
+                files[path] = f
+                # the mapping is released when the last reference is dropped
+                while len(files) > MappedGribFile.MAX_MAPPED_FILES:
+                    files.popitem(last=False)
+            else:
+                files.move_to_end(path)
+        return f
+
+
+class FilePool:
+    """LRU pool of the files opened to read the messages of lazily loaded
+    Fields when READ_WITH_MMAP is disabled. At most max_files are kept open, a
+    file is opened again when it changed.
+    """
+
+    def __init__(self, max_files=64):
+        self.max_files = max_files
+        self._files = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._files)
+
+    def read(self, path, offset, length):
+        st = os.stat(path)
+        fingerprint = (st.st_size, st.st_mtime_ns, st.st_ino)
+        with self._lock:
+            entry = self._files.get(path)
+            if entry is None or entry[1] != fingerprint:
+                if entry is not None:
+                    entry[0].close()
+                entry = (open(path, "rb"), fingerprint)
+                self._files[path] = entry
+                while len(self._files) > self.max_files:
+                    self._files.popitem(last=False)[1][0].close()
+            else:
+                self._files.move_to_end(path)
+            return os.pread(entry[0].fileno(), length, offset)
+
+    def clear(self):
+        with self._lock:
+            for f, _ in self._files.values():
+                f.close()
+            self._files.clear()
+
+
+FILE_POOL = FilePool()
+
+
+class HandlePool:
+    """LRU pool limiting the number of live handles of lazily loaded Fields.
+
+    Only Fields created with a message reference (path, offset, length) are
+    managed here. When either limit is exceeded the handle of the least
+    recently used Field is released; it is loaded again on next access.
+    """
+
+    def __init__(self, max_handles=1000, max_memory=512 * 1024 * 1024):
+        self.max_handles = max_handles
+        self.max_memory = max_memory
+        self.memory = 0
+        self._fields = OrderedDict()
+        # Fields can be accessed from the threads of the executor
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._fields)
+
+    def touch(self, field):
+        key = id(field)
+        with self._lock:
+            if key in self._fields:
+                self._fields.move_to_end(key)
+            else:
+                size = self._size(field)
+                self._fields[key] = (weakref.ref(field, self._forget(key)), size)
+                self.memory += size
+                self._evict()
+
+    def _size(self, field):
+        return field.ref[2]
+
+    def _forget(self, key):
+        def _callback(_):
+            self.discard(key)
+
+        return _callback
+
+    def discard(self, key):
+        with self._lock:
+            item = self._fields.pop(key, None)
+            if item is not None:
+                self.memory -= item[1]
+
+    def _evict(self):
+        while len(self._fields) > 1 and (
+            len(self._fields) > self.max_handles or self.memory > self.max_memory
+        ):
+            key, (ref, size) = self._fields.popitem(last=False)
+            self.memory -= size
+            field = ref()
+            if field is not None:
+                field._handle = None
+
+    def clear(self):
+        with self._lock:
+            while self._fields:
+                _, (ref, _) = self._fields.popitem(last=False)
+                field = ref()
+                if field is not None:
+                    field._handle = None
+            self.memory = 0
+
+
+HANDLE_POOL = HandlePool()
+
+
+class ResultMemory(HandlePool):
+    """Tracks the in-memory results when MEMORY_RESULTS is enabled.
+
+    When the total size of the results exceeds max_memory the oldest ones
+    are written into a temporary file until the total drops to half of the
+    limit. The spilled Fields then load their handle on demand.
+    """
+
+    def __init__(self, max_memory=1024 * 1024 * 1024):
+        super().__init__(max_handles=None, max_memory=max_memory)
+
+    def _size(self, field):
+        size = eccodes.codes_get_message_size(field.handle.handle)
+        if field.vals is not None:
+            size += field.vals.nbytes
+        return size
+
+    def _evict(self):
+        if self.memory <= self.max_memory:
+            return
+        tmp = temp_file()
+        with open(tmp.path, "wb") as fout:
+            while len(self._fields) > 1 and self.memory > self.max_memory / 2:
+                _, (ref, size) = self._fields.popitem(last=False)
+                self.memory -= size
+                field = ref()
+                if field is not None:
+                    offset = fout.tell()
+                    field.write(fout, tmp.path, temp=tmp)
+                    field.ref = (tmp.path, offset, fout.tell() - offset)
+                    field._handle = None
+                    field.vals = None
+
+    def clear(self):
+        with self._lock:
+            self._fields.clear()
+            self.memory = 0
+
+
+RESULT_MEMORY = ResultMemory()
+
+
+class FieldExpr:
+    """A deferred maths operation on the values of Fields.
+
+    The args can be Fields (possibly deferred themselves), scalars or
+    ndarrays. The metadata of the result comes from template, which is
+    always a non-deferred Field.
+    """
+
+    def __init__(self, func, args, template):
+        self.func = func
+        self.args = args
+        self.template = template
+
+    def _children(self):
+        return [a.expr for a in self.args if isinstance(a, Field) and a.expr]
+
+    def evaluate(self):
+        # count how many times each node is used so that shared sub-expressions
+        # are computed only once and copied only while still needed elsewhere
+        uses = {}
+        stack = [self]
+        while stack:
+            e = stack.pop()
+            for c in e._children():
+                uses[id(c)] = uses.get(id(c), 0) + 1
+                if uses[id(c)] == 1:
+                    stack.append(c)
+
+        # iterative post-order traversal, so long chains of operators do
+        # not hit the recursion limit
+        results = {}
+        stack = [self]
+        while stack:
+            e = stack[-1]
+            pending = [c for c in e._children() if id(c) not in results]
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            if id(e) in results:
+                continue
+            args = []
+            for a in e.args:
+                if isinstance(a, Field):
+                    if a.expr:
+                        v = results[id(a.expr)]
+                        uses[id(a.expr)] -= 1
+                        if uses[id(a.expr)] > 0:
+                            v = v.copy()
+                        else:
+                            del results[id(a.expr)]
+                    else:
+                        v = a.values()
+                        # some functions modify their input in place
+                        if v is a.vals:
+                            v = v.copy()
+                    args.append(v)
+                else:
+                    args.append(a)
+            results[id(e)] = e.func(*args)
+        return results[id(self)]
 
 
 class Field:
     """Encapsulates single GRIB message"""
 
-    def __init__(self, handle, gribfile, keep_values_in_memory=False, temp=None):
-        self.handle = handle
+    def __init__(
+        self,
+        handle,
+        gribfile,
+        keep_values_in_memory=False,
+        temp=None,
+        ref=None,
+        header=None,
+    ):
+        self._handle = handle
+        self.ref = ref
+        # the cached key values, initialised from the header of a sidecar index
+        self.meta = dict(header) if header else {}
         self.gribfile = gribfile
         self.temp = temp
         self.vals = None
         self.keep_values_in_memory = keep_values_in_memory
+        self.expr = None
 
-    def grib_get(self, *args, **kwargs):
-        return self.handle.get_any(*args, **kwargs)
+    @staticmethod
+    def deferred(func, args, template):
+        """Creates a Field whose values are computed only when needed"""
+        if template.expr:
+            template = template.expr.template
+        result = Field(None, template.gribfile, template.keep_values_in_memory)
+        args = [a.copy() if isinstance(a, np.ndarray) else a for a in args]
+        result.expr = FieldExpr(func, args, template)
+        return result
 
-    def values(self):
+    @property
+    def handle(self):
+        # fields with a message reference load their handle on demand
+        if self.ref is not None:
+            # the pool can release self._handle at any time from another thread
+            handle = self._handle
+            if handle is None:
+                handle = GribFile.load_handle(*self.ref)
+                self._handle = handle
+            HANDLE_POOL.touch(self)
+            return handle
+        # deferred fields are only encoded when the handle is needed
+        elif self._handle is None and self.expr:
+            self._handle = self.expr.template.handle.clone()
+            self._handle.set_long("bitmapPresent", 1)
+            self._handle.set_values(self.values())
+        return self._handle
+
+    @handle.setter
+    def handle(self, value):
+        self._handle = value
+        self.meta = {}
+
+    def __reduce_ex__(self, protocol):
+        return (Field.__new__, (Field,), self._pickle_state(protocol))
+
+    def _pickle_state(self, protocol):
+        state = {
+            "gribfile": self.gribfile,
+            "keep_values_in_memory": self.keep_values_in_memory,
+            "header": self.meta,
+        }
+        src = self.source() if PICKLE_BY_REFERENCE and self.temp is None else None
+        if src is not None:
+            state["ref"] = src
+            return state
+
+        # an unloaded message is taken straight from the file mapping
+        if self._handle is None and self.ref is not None and READ_WITH_MMAP:
+            path, offset, length = self.ref
+            message = MappedGribFile.get(path).buffer[offset : offset + length]
+        else:
+            message = eccodes.codes_get_message(self.handle.handle)
+        # with protocol 5 the message is an out-of-band buffer, which is not
+        # copied into the pickle when a buffer_callback is used
+        if protocol >= 5:
+            state["message"] = pickle.PickleBuffer(message)
+        else:
+            state["message"] = bytes(message)
+        return state
+
+    def __setstate__(self, state):
+        if "ref" in state:
+            self.__init__(
+                None,
+                state["gribfile"],
+                state["keep_values_in_memory"],
+                ref=state["ref"],
+                header=state["header"],
+            )
+            return
+        # an out-of-band buffer can be any object supporting the buffer protocol
+        message = memoryview(state["message"])
+        handle = CodesHandle(eccodes.codes_new_from_message(message), None, None)
+        self.__init__(
+            handle,
+            state["gribfile"],
+            state["keep_values_in_memory"],
+            header=state["header"],
+        )
+
+    def grib_get(self, keys, key_type=None):
+        # The scalar key values are cached since a Field is not modified once
+        # created, apart from encode_values() and grib_set() on new clones.
+        # A missing key is cached as None.
+        meta = self.meta
+        stats = metadata.CACHE_STATS
+        if key_type is not None:
+            name = f"{keys}:{key_type[0]}"
+            v = meta.get(name)
+            if v is not None:
+                stats.hits += 1
+                return v
+            stats.misses += 1
+            v = self.handle.get_any(keys, key_type=key_type)
+            if (
+                METADATA_CACHE
+                and key_type[0] in metadata.CACHED_KEY_TYPES
+                and not isinstance(v, np.ndarray)
+            ):
+                meta[name] = v
+            return v
+
+        result = []
+        for s in metadata.reader(keys).specs:
+            v = meta.get(s.name, meta)
+            if v is meta:
+                stats.misses += 1
+                v = s.get(self.handle.handle)
+                if (
+                    METADATA_CACHE
+                    and s.key_type in metadata.CACHED_KEY_TYPES
+                    and not isinstance(v, np.ndarray)
+                ):
+                    meta[s.name] = v
+            else:
+                stats.hits += 1
+            result.append(v)
+        return result
+
+    def values(self, dtype=None):
         if self.vals is None:
-            vals = self.handle.get_values()
+            if self.expr:
+                vals = self.expr.evaluate()
+            elif dtype is not None and dtype != np.float64:
+                # values of another type are never cached
+                return self.handle.get_values(dtype=dtype)
+            else:
+                vals = self.handle.get_values()
             if self.keep_values_in_memory:
                 self.vals = vals
         else:
             vals = self.vals
+        if dtype is not None:
+            vals = vals.astype(dtype, copy=False)
         return vals
 
+    def geometry(self):
+        """Returns the read-only Geometry shared by the Fields on the same grid"""
+        key = self.grib_get("md5GridSection", key_type=CodesHandle.STRING)
+        return GEOMETRY_CACHE.get(key, lambda: self.handle)
+
     def latitudes(self):
-        return self.handle.get_double_array("latitudes")
+        return self.geometry().latitudes.copy()
 
     def longitudes(self):
-        return self.handle.get_double_array("longitudes")
+        return self.geometry().longitudes.copy()
 
     def grib_set(self, *args, **kwargs):
         result = self.clone()
         result.handle.set_any(*args, **kwargs)
+        result.meta = {}
         return result
 
     def encode_values(self, value):
+        self.meta = {}
         self.handle.set_long("bitmapPresent", 1)
         self.handle.set_values(value)
-        if not self.keep_values_in_memory:
+        # in-memory results keep the values decoded from the packed message so
+        # they do not change when the result is spilled to disk
+        if MEMORY_RESULTS:
+            self.vals = self.handle.get_values()
+        elif not self.keep_values_in_memory:
             self.vals = None
 
     def write(self, fout, path, temp=None):
         self.temp = temp  # store a reference to the temp file object for persistence
         self.handle.write(fout, path)
 
+    def source(self, stats=None):
+        """Returns the (path, offset, length) of the message in its file or None
+        if the field was modified, only exists in memory or its file changed
+        since the message was read. stats caches GribFile.stat() by path."""
+        h = self._handle
+        if h is None:
+            return self.ref
+        if h.path is None or h.message_offset is None or h.fingerprint is None:
+            return None
+        if stats is None:
+            stats = {}
+        if h.path not in stats:
+            stats[h.path] = GribFile.stat(h.path)
+        if stats[h.path] != h.fingerprint:
+            return None
+        if self.ref is not None:
+            return self.ref
+        return (h.path, h.message_offset, eccodes.codes_get_message_size(h.handle))
+
+    def relocate(self, path, offset, length):
+        """Makes the field refer to a copy of its message"""
+        self.temp = None
+        if self.ref is not None:
+            self.ref = (path, offset, length)
+        if self._handle is not None:
+            self._handle.path = path
+            self._handle.offset = offset
+            self._handle.message_offset = offset
+            self._handle.fingerprint = None
+
     def grib_index(self):
+        if self._handle is None and self.ref is not None:
+            return (self.ref[0], self.ref[1])
         return (self.handle.path, self.handle.offset)
         # return (self.handle.path, self.grib_get("offset", key_type=CodesHandle.LONG))
 
@@ -250,6 +821,8 @@ class Field:
 
     def field_func(self, func):
         """Applies a function to all values, returning a new Field"""
+        if LAZY_EVALUATION:
+            return Field.deferred(func, [self], self)
         result = self.clone()
         result.vals = func(self.values())
         result.encode_values(result.vals)
@@ -257,6 +830,9 @@ class Field:
 
     def field_other_func(self, func, other, reverse_args=False):
         """Applies a function with something to all values, returning a new Field"""
+        if LAZY_EVALUATION:
+            args = [other, self] if reverse_args else [self, other]
+            return Field.deferred(func, args, self)
         result = self.clone()
         if isinstance(other, Field):
             other = other.values()
@@ -345,7 +921,13 @@ class Fieldset:
     # INT_KEYS = ["Nx", "Ny", "number"]
 
     def __init__(
-        self, path=None, fields=None, keep_values_in_memory=False, temporary=False
+        self,
+        path=None,
+        fields=None,
+        keep_values_in_memory=False,
+        temporary=False,
+        lazy_load=False,
+        sidecar=False,
     ):
         self.fields = []
         self.count = 0
@@ -365,10 +947,40 @@ class Fieldset:
                 path = utils.get_file_list(path)
 
             for p in path:
-                g = GribFile(p)
-                self.count = len(g)
-                for handle in g:
-                    self.fields.append(Field(handle, p, keep_values_in_memory))
+                if sidecar:
+                    # message locations and header values come from the
+                    # sidecar index, handles are loaded on demand
+                    idx = GribFile.load_sidecar(p)
+                    self.count = len(idx)
+                    for ref, header in zip(idx.refs(), idx.headers()):
+                        self.fields.append(
+                            Field(
+                                None,
+                                p,
+                                keep_values_in_memory,
+                                ref=ref,
+                                header=header,
+                            )
+                        )
+                elif lazy_load:
+                    # only the message locations are read, handles are
+                    # created on first access and managed by HANDLE_POOL
+                    refs = GribFile.scan_offsets(p)
+                    self.count = len(refs)
+                    for offset, length in refs:
+                        self.fields.append(
+                            Field(
+                                None,
+                                p,
+                                keep_values_in_memory,
+                                ref=(p, offset, length),
+                            )
+                        )
+                else:
+                    g = GribFile(p)
+                    self.count = len(g)
+                    for handle in g:
+                        self.fields.append(Field(handle, p, keep_values_in_memory))
         if temporary:
             self.temporary = temp_file()
         if fields:
@@ -377,6 +989,14 @@ class Fieldset:
     def __len__(self):
         return len(self.fields)
 
+    def __getstate__(self):
+        # the temporary file and the index belong to this process, the fields
+        # are pickled with their messages
+        state = self.__dict__.copy()
+        state["temporary"] = None
+        state["_db"] = None
+        return state
+
     def __str__(self):
         n = len(self)
         s = "s" if n > 1 else ""
@@ -404,19 +1024,56 @@ class Fieldset:
     def grib_get(self, keys, grouping="field"):
         if grouping not in ["field", "key"]:
             raise ValueError(f"grib_get: grouping must be field or key, not {grouping}")
-        ret = self._grib_get(keys, as_list=True)
         if grouping == "key":
-            ret = list(map(list, zip(*ret)))  # transpose lists of lists
-        return ret
+            cols = self.grib_get_columns(keys)
+            return [cols[k] for k in keys]
+        return self._grib_get(keys, as_list=True)
+
+    def grib_get_columns(self, keys, as_numpy=False, headers_only=False):
+        """
+        Returns a dict with the list of values of each key in keys for all
+        the fields. With as_numpy the lists are converted into ndarrays. With
+        headers_only the fields not loaded yet are read from the header of
+        their message without loading the data section, so only header keys
+        can be used.
+        """
+        r = metadata.reader(keys)
+        fields = self.fields
+        rows = [None] * len(fields)
+        if headers_only:
+            todo = {}
+            for i, f in enumerate(fields):
+                if (
+                    f._handle is None
+                    and f.ref is not None
+                    and any(s.name not in f.meta for s in r.specs)
+                ):
+                    todo.setdefault(f.ref[0], []).append(i)
+            for path, pos in todo.items():
+                hdr = r.read_messages(path, [fields[i].ref[1] for i in pos])
+                for i, row in zip(pos, zip(*hdr)):
+                    rows[i] = row
+                    if METADATA_CACHE:
+                        meta = fields[i].meta
+                        for s, v in zip(r.specs, row):
+                            if (
+                                s.key_type in metadata.CACHED_KEY_TYPES
+                                and not isinstance(v, np.ndarray)
+                            ):
+                                meta[s.name] = v
+
+        cols = [[] for _ in keys]
+        for f, row in zip(fields, rows):
+            if row is None:
+                row = f.grib_get(r.keys)
+            for c, v in zip(cols, row):
+                c.append(v)
+        if as_numpy:
+            cols = [metadata.to_array(c, s.key_type) for c, s in zip(cols, r.specs)]
+        return dict(zip(keys, cols))
 
     def _grib_set(self, *args, **kwargs):
-        result = Fieldset(temporary=True)
-        path = result.temporary.path
-        with open(path, "wb") as fout:
-            for f in self.fields:
-                result._append_field(f.grib_set(*args, **kwargs))
-                result.fields[-1].write(fout, path, temp=result.temporary)
-        return result
+        return Fieldset._make_result([f.grib_set(*args, **kwargs) for f in self.fields])
 
     def grib_set_string(self, keys_and_vals):
         return self._grib_set(keys_and_vals, key_type=CodesHandle.STRING)
@@ -433,9 +1090,47 @@ class Fieldset:
     # def grib_set_double_array(self, key, value):
     #    return self._grib_set_any(key, value, "grib_set_double_array")
 
-    def values(self):
-        v = [x.values() for x in self.fields]
-        return self._make_2d_array(v)
+    def values(self, dtype=None, out=None):
+        """
+        Returns the values of the fields as a 2D ndarray of shape
+        (number_of_fields, number_of_points), or a 1D ndarray for a single
+        field. The values are decoded directly into a preallocated array of
+        dtype (float64 by default). out can be an existing 2D array to decode
+        into, e.g. a np.memmap, in which case it is returned.
+        """
+        fields = self.fields
+        if len(fields) == 0:
+            if out is not None:
+                return out
+            raise ValueError("Fieldset.values: the fieldset is empty")
+
+        if out is not None:
+            if out.ndim != 2 or out.shape[0] != len(fields):
+                raise ValueError(
+                    f"Fieldset.values: out must have shape ({len(fields)}, number_of_points), not {out.shape}"
+                )
+            dtype = out.dtype
+        elif dtype is None:
+            dtype = np.float64
+
+        single = out is None and len(fields) == 1
+
+        # the decoding is dispatched to the executor in batches so that only
+        # a batch of per-field arrays is alive besides the result
+        batch_size = executor.EXECUTOR.batch_size
+        func = partial(_field_values_one, dtype=dtype)
+        for start in range(0, len(fields), batch_size):
+            vals = map_fields(func, fields[start : start + batch_size])
+            for i, v in enumerate(vals):
+                if out is None:
+                    out = np.empty((len(fields), len(v)), dtype=dtype)
+                elif len(v) != out.shape[1]:
+                    raise ValueError(
+                        f"Fieldset.values: field={start + i} has {len(v)} values instead of {out.shape[1]}"
+                    )
+                out[start + i] = v
+            vals = None
+        return out[0] if single else out
 
     def set_values(self, values):
         if isinstance(values, list):
@@ -454,9 +1149,61 @@ class Fieldset:
         )
 
     def write(self, path):
-        with open(path, "wb") as fout:
-            for f in self.fields:
-                f.write(fout, path)
+        # The unmodified messages are copied from their files, contiguous
+        # runs in one go, and only the other fields are encoded. When path is
+        # one of the source files the result is written into a temporary file
+        # first.
+        stats = {}
+        sources = [f.source(stats) for f in self.fields]
+        out_path = path
+        if os.path.exists(path) and any(
+            s is not None and os.path.samefile(s[0], path) for s in sources
+        ):
+            out_path = path + ".tmp"
+
+        files = {}
+        try:
+            with open(out_path, "wb") as fout:
+                i = 0
+                while i < len(self.fields):
+                    src = sources[i]
+                    if src is None:
+                        self.fields[i].write(fout, path)
+                        i += 1
+                        continue
+                    # the run of messages stored next to each other
+                    j = i + 1
+                    end = src[1] + src[2]
+                    while (
+                        j < len(self.fields)
+                        and sources[j] is not None
+                        and sources[j][0] == src[0]
+                        and sources[j][1] == end
+                    ):
+                        end += sources[j][2]
+                        j += 1
+                    if src[0] not in files:
+                        files[src[0]] = open(src[0], "rb")
+                    pos = fout.tell()
+                    GribFile.copy_bytes(files[src[0]], fout, src[1], end - src[1])
+                    for k in range(i, j):
+                        offset = pos + sources[k][1] - src[1]
+                        self.fields[k].relocate(path, offset, sources[k][2])
+                    i = j
+        finally:
+            for f in files.values():
+                f.close()
+        if out_path != path:
+            os.replace(out_path, path)
+        Fieldset._set_fingerprint(self.fields, path)
+
+    @staticmethod
+    def _set_fingerprint(fields, path):
+        # the fields written into path can be copied from it from now on
+        fingerprint = GribFile.stat(path)
+        for f in fields:
+            if f._handle is not None and f._handle.path == path:
+                f._handle.fingerprint = fingerprint
 
     def grib_index(self):
         return [i.grib_index() for i in self.fields]
@@ -468,7 +1215,7 @@ class Fieldset:
     def __getitem__(self, index):
         try:
             if isinstance(index, np.ndarray):
-                return Fieldset(fields=[self.fields[i] for i in index])
+                return self.take(index)
             # # GRIB key
             # elif isinstance(index, str):
             #     keyname = index
@@ -498,6 +1245,49 @@ class Fieldset:
             # print("This Fieldset contains", len(self), "fields; index is", index)
             raise ide
 
+    @staticmethod
+    def from_refs(refs, keep_values_in_memory=False):
+        """
+        Creates a Fieldset from (path, offset, length) message references. The
+        handles are only loaded when needed and are managed by HANDLE_POOL.
+        """
+        return Fieldset(
+            fields=[
+                Field(None, path, keep_values_in_memory, ref=(path, offset, length))
+                for path, offset, length in refs
+            ]
+        )
+
+    def take(self, indices):
+        """
+        Returns a new Fieldset with the Fields at indices, which can be any
+        integer array-like or a boolean mask. The Fields are shared and the
+        result is built in one go.
+        """
+        indices = np.asarray(indices)
+        if indices.ndim != 1:
+            raise ValueError(f"take(): indices must be 1D (got ndim={indices.ndim})!")
+        if indices.dtype == bool:
+            if len(indices) != len(self.fields):
+                raise IndexError(
+                    f"take(): boolean mask has {len(indices)} elements for {len(self.fields)} fields!"
+                )
+            indices = np.flatnonzero(indices)
+        elif indices.size == 0:
+            indices = indices.astype(np.int64)
+        elif not np.issubdtype(indices.dtype, np.integer):
+            raise TypeError(
+                f"take(): indices must be integers (got dtype={indices.dtype})!"
+            )
+        fields = self.fields
+        return Fieldset(fields=[fields[i] for i in indices.tolist()])
+
+    def view(self):
+        """Returns a new Fieldset sharing the Fields and the index of this one"""
+        r = Fieldset(fields=list(self.fields))
+        r._db = self._db
+        return r
+
     def append(self, other):
         self.fields = self.fields + other.fields
         self._db = None
@@ -528,16 +1318,18 @@ class Fieldset:
     #         dataset = xr.open_dataset(self, engine="cfgrib", backend_kwargs=kwarg)
     #     return dataset
 
+    @staticmethod
+    def _map_fields(func, *iterables):
+        # building deferred Fields is cheap so it is not worth dispatching
+        if LAZY_EVALUATION:
+            return [func(*args) for args in zip(*iterables)]
+        return map_fields(func, *iterables)
+
     def field_func(self, func):
         """Applies a function to all values in all fields"""
-        result = Fieldset(temporary=True)
-        with open(result.temporary.path, "wb") as fout:
-            for f in self.fields:
-                result._append_field(f.field_func(func))
-                result.fields[-1].write(
-                    fout, result.temporary.path, temp=result.temporary
-                )
-        return result
+        return Fieldset._make_result(
+            Fieldset._map_fields(Field.field_func, self.fields, repeat(func))
+        )
 
     def fieldset_other_func(
         self,
@@ -552,31 +1344,25 @@ class Fieldset:
         #     f"Fieldset.fieldset_other_func() func={func}, other={other}, reverse_args={reverse_args}, index_other={index_other}, use_first_from_other={use_first_from_other}"
         # )
 
-        def _process_one(f, g, result):
-            new_field = f.field_other_func(func, g, reverse_args=reverse_args)
-            result._append_field(new_field)
-            result.fields[-1].write(fout, result.temporary.path, temp=result.temporary)
-
-        result = Fieldset(temporary=True)
-        with open(result.temporary.path, "wb") as fout:
-            if isinstance(other, Fieldset):
-                if len(other) == len(self.fields):
-                    for f, g in zip(self.fields, other.fields):
-                        _process_one(f, g, result)
-                elif use_first_from_other:
-                    for f in self.fields:
-                        _process_one(f, other.fields[0], result)
-                else:
-                    raise Exception(
-                        f"Fieldsets must have the same number of fields for this operation! {len(self.fields)} != {len(other)}"
-                    )
-            elif index_other:
-                for f, g in zip(self.fields, other):
-                    _process_one(f, g, result)
+        if isinstance(other, Fieldset):
+            if len(other) == len(self.fields):
+                other = other.fields
+            elif use_first_from_other:
+                other = repeat(other.fields[0])
             else:
-                for f in self.fields:
-                    _process_one(f, other, result)
-        return result
+                raise Exception(
+                    f"Fieldsets must have the same number of fields for this operation! {len(self.fields)} != {len(other)}"
+                )
+        elif not index_other:
+            other = repeat(other)
+
+        return Fieldset._make_result(
+            Fieldset._map_fields(
+                partial(_field_other_func_one, func=func, reverse_args=reverse_args),
+                self.fields,
+                other,
+            )
+        )
 
     def base_date(self):
         if len(self.fields) > 0:
@@ -628,94 +1414,100 @@ class Fieldset:
 
     def _make_single_result(self, v):
         assert len(self) > 0
-        result = Fieldset(temporary=True)
-        with open(result.temporary.path, "wb") as fout:
-            f = self.fields[0].clone()
-            f.encode_values(v)
-            result._append_field(f)
-            result.fields[-1].write(fout, result.temporary.path, temp=result.temporary)
-        return result
+        f = self.fields[0].clone()
+        f.encode_values(v)
+        return Fieldset._make_result([f])
 
-    def mean(self):
+    def _reduce(self, name):
         if len(self.fields) > 0:
-            v = self.fields[0].values()
-            for i in range(1, len(self.fields)):
-                v += self.fields[i].values()
-            v = v / len(self.fields)
+            v = reduction.reduce_fields(self.fields, name)
             return self._make_single_result(v)
         else:
             return None
 
+    def mean(self):
+        return self._reduce("mean")
+
     def rms(self):
-        if len(self.fields) > 0:
-            v = np.square(self.fields[0].values())
-            for i in range(1, len(self.fields)):
-                v += np.square(self.fields[i].values())
-            v = np.sqrt(v / len(self.fields))
-            return self._make_single_result(v)
-        else:
-            return None
+        return self._reduce("rms")
 
     def stdev(self):
-        v = self._compute_var()
-        return self._make_single_result(np.sqrt(v)) if v is not None else None
+        return self._reduce("stdev")
 
     def sum(self):
-        if len(self.fields) > 0:
-            v = self.fields[0].values()
-            for i in range(1, len(self.fields)):
-                v += self.fields[i].values()
-            return self._make_single_result(v)
-        else:
-            return None
+        return self._reduce("sum")
 
     def var(self):
-        v = self._compute_var()
-        return self._make_single_result(v) if v is not None else None
+        return self._reduce("var")
+
+    def min(self):
+        return self._reduce("min")
+
+    def max(self):
+        return self._reduce("max")
 
-    def _compute_var(self):
+    def percentile(self, percentiles):
         if len(self.fields) > 0:
-            v2 = self.fields[0].values()
-            v1 = np.square(v2)
-            for i in range(1, len(self.fields)):
-                v = self.fields[i].values()
-                v1 += np.square(v)
-                v2 += v
-            return v1 / len(self.fields) - np.square(v2 / len(self.fields))
+            v = reduction.percentile_fields(self.fields, percentiles)
+            if np.ndim(percentiles) == 0:
+                return self._make_single_result(v)
+            fields = []
+            for x in v:
+                f = self.fields[0].clone()
+                f.encode_values(x)
+                fields.append(f)
+            return Fieldset._make_result(fields)
+        else:
+            return None
+
+    def _geometry_array(self, name):
+        v = [getattr(x.geometry(), name) for x in self.fields]
+        # the geometry arrays are shared so a single one is copied
+        return v[0].copy() if len(v) == 1 else Fieldset._make_2d_array(v)
 
     def latitudes(self):
-        v = [x.latitudes() for x in self.fields]
-        return Fieldset._make_2d_array(v)
+        return self._geometry_array("latitudes")
 
     def longitudes(self):
-        v = [x.longitudes() for x in self.fields]
-        return Fieldset._make_2d_array(v)
+        return self._geometry_array("longitudes")
 
-    def _lat_func(self, func, bitmap_poles=False):
-        result = Fieldset(temporary=True)
-        pole_limit = 90.0 - 1e-06
-        with open(result.temporary.path, "wb") as fout:
-            for f in self.fields:
-                lat = f.latitudes()
-                if bitmap_poles:
-                    lat[np.fabs(lat) > pole_limit] = np.nan
-                v = func(np.deg2rad(lat))
-                c = f.clone()
-                c.encode_values(v)
-                result._append_field(c)
-                result.fields[-1].write(
-                    fout, result.temporary.path, temp=result.temporary
-                )
-        return result
+    def _geometry_func(self, name):
+        return Fieldset._make_result(
+            map_fields(partial(_geometry_func_one, name=name), self.fields)
+        )
 
     def coslat(self):
-        return self._lat_func(np.cos)
+        return self._geometry_func("coslat")
 
     def sinlat(self):
-        return self._lat_func(np.sin)
+        return self._geometry_func("sinlat")
 
     def tanlat(self):
-        return self._lat_func(np.tan, bitmap_poles=True)
+        return self._geometry_func("tanlat")
+
+    def grid_cell_area(self):
+        return self._geometry_func("cell_areas")
+
+    @staticmethod
+    def _make_result(fields):
+        """
+        Creates a Fieldset from newly computed Fields. The Fields are written
+        into a temporary file unless they are deferred or MEMORY_RESULTS is
+        enabled.
+        """
+        result = Fieldset(fields=fields)
+        computed = [f for f in fields if f.expr is None]
+        if MEMORY_RESULTS:
+            for f in computed:
+                RESULT_MEMORY.touch(f)
+        elif computed:
+            result.temporary = temp_file()
+            path = result.temporary.path
+            with open(path, "wb") as fout:
+                for f in computed:
+                    f.write(fout, path, temp=result.temporary)
+            Fieldset._set_fingerprint(computed, path)
+        return result
 
     @staticmethod
     def _list_or_single(lst):
@@ -744,12 +1536,8 @@ class Fieldset:
 
     # TODO: function to write to single file if fields from different files
 
-    # TODO: optimise write() to copy file if exists
-
     # TODO: to_dataset()
 
-    # TODO: pickling
-
     # TODO: gribsetbits, default=24
 
     def _get_db(self):
@@ -790,31 +1578,52 @@ class Fieldset:
             return u.speed(v)
         elif len(args) == 1:
             other = args[0]
-            result = Fieldset(temporary=True)
-            param_ids = {
-                131: 10,  # atmospheric wind
-                165: 207,  # 10m wind
-                228246: 228249,  # 100m wind
-                228239: 228241,  # 200m wind
-            }
             if len(self.fields) != len(other):
                 raise Exception(
                     f"Fieldsets must have the same number of fields for this operation! {len(self.fields)} != {len(other)}"
                 )
-            with open(result.temporary.path, "wb") as fout:
-                for f, g in zip(self.fields, other.fields):
-                    sp = np.sqrt(np.square(f.values()) + np.square(g.values()))
-                    c = f.clone()
-                    c.encode_values(sp)
-                    param_id_u = f.grib_get("paramId", CodesHandle.LONG)
-                    param_id_sp = param_ids.get(param_id_u, None)
-                    if param_id_sp is not None:
-                        c = c.grib_set(["paramId", param_id_sp], CodesHandle.LONG)
-                    result._append_field(c)
-                    result.fields[-1].write(
-                        fout, result.temporary.path, temp=result.temporary
-                    )
-            return result
+            return Fieldset._make_result(
+                map_fields(_speed_one, self.fields, other.fields)
+            )
+
+
+# per-field tasks dispatched to the executor. They have to be module level
+# functions so that they can be sent to worker processes.
+
+
+def _field_values_one(f, dtype):
+    return f.values(dtype=dtype)
+
+
+def _field_other_func_one(f, g, func, reverse_args):
+    return f.field_other_func(func, g, reverse_args=reverse_args)
+
+
+def _geometry_func_one(f, name):
+    # the trigonometric arrays are computed once per grid
+    v = getattr(f.geometry(), name)
+    c = f.clone()
+    c.encode_values(v)
+    return c
+
+
+SPEED_PARAM_IDS = {
+    131: 10,  # atmospheric wind
+    165: 207,  # 10m wind
+    228246: 228249,  # 100m wind
+    228239: 228241,  # 200m wind
+}
+
+
+def _speed_one(f, g):
+    sp = np.sqrt(np.square(f.values()) + np.square(g.values()))
+    c = f.clone()
+    c.encode_values(sp)
+    param_id_u = f.grib_get("paramId", CodesHandle.LONG)
+    param_id_sp = SPEED_PARAM_IDS.get(param_id_u, None)
+    if param_id_sp is not None:
+        c = c.grib_set(["paramId", param_id_sp], CodesHandle.LONG)
+    return c
 
 
 class FieldsetCF:
@@ -867,6 +1676,94 @@ def read(p):
     return Fieldset(path=p)
 
 
+def _make_filter(select):
+    """Returns the KeySpecs and the sets of accepted values for select"""
+    specs = []
+    accepted = []
+    for k, v in select.items():
+        v = list(v) if isinstance(v, (list, tuple, set)) else [v]
+        if ":" not in k:
+            p = GribIndexer.PREDEF_KEYS.get(k)
+            if p is not None and p[0]:
+                k = f"{k}:{p[0]}"
+            elif isinstance(v[0], int):
+                k = f"{k}:l"
+            elif isinstance(v[0], float):
+                k = f"{k}:d"
+        spec = metadata.KeySpec(k)
+        convert = {"l": int, "d": float}.get(spec.key_type, str)
+        specs.append(spec)
+        accepted.append({convert(x) for x in v})
+    return specs, accepted
+
+
+def iter_fields(paths, select=None, batch=None, keep_values_in_memory=False):
+    """
+    Iterates over the GRIB messages in paths without creating all the Fields
+    up front. Yields Fields, or Fieldsets of at most batch Fields when batch
+    is specified. select is a dict of key values, e.g.
+    {"shortName": "t", "level": [500, 850]}, checked on the header of each
+    message before its data section is read. A Field is only referenced by
+    the caller, so its handle is released as soon as the caller drops it.
+    """
+    specs, accepted = _make_filter(select) if select else ([], [])
+    if not isinstance(paths, list):
+        paths = [paths]
+    files = []
+    for p in paths:
+        files.extend(utils.get_file_list(p))
+
+    fields = []
+    for path in files:
+        fingerprint = GribFile.stat(path)
+        with open(path, "rb") as f:
+            while True:
+                header = {}
+                if specs:
+                    h = eccodes.codes_new_from_file(
+                        f, eccodes.CODES_PRODUCT_GRIB, headers_only=True
+                    )
+                    if h is None:
+                        break
+                    try:
+                        offset = eccodes.codes_get_message_offset(h)
+                        for s, values in zip(specs, accepted):
+                            header[s.name] = s.get(h)
+                            if header[s.name] not in values:
+                                header = None
+                                break
+                    finally:
+                        eccodes.codes_release(h)
+                    if header is None:
+                        continue
+                    f.seek(offset)
+
+                h = eccodes.codes_new_from_file(f, eccodes.CODES_PRODUCT_GRIB)
+                if h is None:
+                    break
+                offset = eccodes.codes_get_message_offset(h)
+                ref = (path, offset, eccodes.codes_get_message_size(h))
+                handle = CodesHandle(h, path, offset)
+                handle.fingerprint = fingerprint
+                field = Field(
+                    handle,
+                    path,
+                    keep_values_in_memory,
+                    ref=ref,
+                    header=header,
+                )
+                if batch is None:
+                    yield field
+                else:
+                    fields.append(field)
+                    if len(fields) == batch:
+                        yield Fieldset(fields=fields)
+                        fields = []
+                field = None
+    if fields:
+        yield Fieldset(fields=fields)
+
+
 # expose all Fieldset functions as a module level function
 def _make_module_func(name):
     def wrapped(fs, *args):
@@ -884,6 +1781,7 @@ for fn in dir(Fieldset):
 def bind_functions(namespace, module_name=None):
     """Add to the module globals all metview functions except operators like: +, &, etc."""
     namespace["read"] = read
+    namespace["iter_fields"] = iter_fields
     for fn in dir(Fieldset):
         if callable(getattr(Fieldset, fn)) and not fn.startswith("_"):
             namespace[fn] = _make_module_func(fn)
@@ -0,0 +1,143 @@
+# (C) Copyright 2017- ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation
+# nor does it submit to any jurisdiction.
+#
+
+from collections import OrderedDict
+import threading
+
+import numpy as np
+
+# the radius of the Earth used by the ECMWF models
+EARTH_RADIUS = 6371229.0
+
+# the latitudes beyond this are treated as poles
+POLE_LIMIT = 90.0 - 1e-06
+
+
+class Geometry:
+    """
+    The geometry of a grid, shared by all the Fields on that grid. The
+    latitudes and longitudes are decoded once, the derived arrays are only
+    computed when first used. All the arrays are read-only.
+    """
+
+    def __init__(self, handle):
+        self.grid_type = handle.get_string("gridType")
+        self._arrays = {}
+        # derived arrays are computed from other derived arrays
+        self._lock = threading.RLock()
+        self._params = {}
+        if self.grid_type == "regular_ll":
+            for k in ["iDirectionIncrementInDegrees", "jDirectionIncrementInDegrees"]:
+                self._params[k] = handle.get_double(k)
+        for k in ["latitudes", "longitudes"]:
+            v = handle.get_double_array(k)
+            v.flags.writeable = False
+            self._arrays[k] = v
+
+    def _get(self, name, func):
+        v = self._arrays.get(name)
+        if v is None:
+            with self._lock:
+                v = self._arrays.get(name)
+                if v is None:
+                    v = func()
+                    v.flags.writeable = False
+                    self._arrays[name] = v
+        return v
+
+    @property
+    def latitudes(self):
+        return self._arrays["latitudes"]
+
+    @property
+    def longitudes(self):
+        return self._arrays["longitudes"]
+
+    @property
+    def lat_rad(self):
+        return self._get("lat_rad", lambda: np.deg2rad(self.latitudes))
+
+    @property
+    def lon_rad(self):
+        return self._get("lon_rad", lambda: np.deg2rad(self.longitudes))
+
+    @property
+    def coslat(self):
+        return self._get("coslat", lambda: np.cos(self.lat_rad))
+
+    @property
+    def sinlat(self):
+        return self._get("sinlat", lambda: np.sin(self.lat_rad))
+
+    @property
+    def tanlat(self):
+        def _tanlat():
+            v = np.tan(self.lat_rad)
+            # tan is not defined at the poles
+            v[np.fabs(self.latitudes) > POLE_LIMIT] = np.nan
+            return v
+
+        return self._get("tanlat", _tanlat)
+
+    @property
+    def cell_areas(self):
+        """The area of the grid cells in m2. Only regular_ll grids are supported."""
+
+        def _cell_areas():
+            if self.grid_type != "regular_ll":
+                raise ValueError(
+                    f"Unsupported gridType={self.grid_type} for cell areas. Only regular_ll is accepted!"
+                )
+            dx = np.deg2rad(self._params["iDirectionIncrementInDegrees"])
+            dy = self._params["jDirectionIncrementInDegrees"] / 2.0
+            north = np.deg2rad(np.clip(self.latitudes + dy, -90.0, 90.0))
+            south = np.deg2rad(np.clip(self.latitudes - dy, -90.0, 90.0))
+            return EARTH_RADIUS**2 * dx * (np.sin(north) - np.sin(south))
+
+        return self._get("cell_areas", _cell_areas)
+
+
+class GeometryCache:
+    """
+    LRU cache of the Geometry of each distinct grid, keyed by the md5 hash of
+    the grid section. At most max_grids geometries are kept.
+    """
+
+    def __init__(self, max_grids=16):
+        self.max_grids = max_grids
+        self._grids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._grids)
+
+    def get(self, key, load_handle):
+        """Returns the Geometry of the grid with the md5GridSection key. The
+        handle is only loaded when the grid is not in the cache yet."""
+        with self._lock:
+            g = self._grids.get(key)
+            if g is not None:
+                self._grids.move_to_end(key)
+                return g
+        # the arrays are decoded outside the lock
+        g = Geometry(load_handle())
+        with self._lock:
+            g = self._grids.setdefault(key, g)
+            self._grids.move_to_end(key)
+            while len(self._grids) > self.max_grids:
+                self._grids.popitem(last=False)
+        return g
+
+    def clear(self):
+        with self._lock:
+            self._grids.clear()
+
+
+GEOMETRY_CACHE = GeometryCache()
@@ -8,10 +8,13 @@
 # nor does it submit to any jurisdiction.
 #
 
+from collections import OrderedDict
 import copy
 import logging
 import os
+import weakref
 
+import numpy as np
 import pandas as pd
 
 from .indexer import GribIndexer, FieldsetIndexer
@@ -23,12 +26,254 @@ from .param import (
 )
 from .ipython import is_ipython_active
 
-
 # logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
 # logging.basicConfig(level=logging.DEBUG, format="%(levelname)s - %(message)s")
 LOG = logging.getLogger(__name__)
 
 
+class MaskCache:
+    """
+    Caches the boolean row masks of the filter conditions for each DataFrame.
+    The entries of a DataFrame are dropped when it is deleted. At most
+    max_masks entries are kept per DataFrame.
+    """
+
+    def __init__(self, max_masks=64):
+        self.max_masks = max_masks
+        self._dfs = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, df, key, func):
+        entry = self._dfs.get(id(df))
+        if entry is None or entry[0]() is not df:
+            ref = weakref.ref(df, self._forget(id(df)))
+            entry = (ref, OrderedDict())
+            self._dfs[id(df)] = entry
+        masks = entry[1]
+        m = masks.get(key)
+        if m is None:
+            self.misses += 1
+            m = func()
+            masks[key] = m
+            while len(masks) > self.max_masks:
+                masks.popitem(last=False)
+        else:
+            self.hits += 1
+            masks.move_to_end(key)
+        return m
+
+    def _forget(self, df_id):
+        def _callback(ref):
+            entry = self._dfs.get(df_id)
+            if entry is not None and entry[0] is ref:
+                del self._dfs[df_id]
+
+        return _callback
+
+    def clear(self):
+        self._dfs.clear()
+
+
+MASK_CACHE = MaskCache()
+
+# when True select() uses the InvertedIndex of the blocks
+INVERTED_INDEX = False
+
+
+class InvertedIndex:
+    """
+    Maps each value of the indexed columns of a DataFrame to the sorted array
+    of the row ids holding it. The row ids of all the values of a column are
+    stored in a single array, which is sliced by offsets.
+    """
+
+    SUFFIX = ".inv.npz"
+
+    def __init__(self, df, columns, fingerprint=None):
+        self._df = weakref.ref(df)
+        self.row_count = len(df)
+        self.columns = columns
+        self.fingerprint = fingerprint
+        # value -> code for each column
+        self._codes = {
+            k: {v: i for i, v in enumerate(c[2])} for k, c in self.columns.items()
+        }
+
+    @staticmethod
+    def build(df, keys=None, fingerprint=None):
+        keys = GribIndexer.DEFAULT_KEYS if keys is None else keys
+        columns = {}
+        for k in keys:
+            if k in df.columns:
+                codes, uniques = pd.factorize(df[k], sort=False)
+                # the stable sort keeps the row ids ascending for each value
+                order = np.argsort(codes, kind="stable")
+                order = order[np.count_nonzero(codes < 0) :]
+                counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+                offsets = np.zeros(len(uniques) + 1, dtype=np.int64)
+                np.cumsum(counts, out=offsets[1:])
+                columns[k] = (order, offsets, list(uniques.tolist()))
+        return InvertedIndex(df, columns, fingerprint=fingerprint)
+
+    def is_valid(self, df, fingerprint=None):
+        return (
+            self._df() is df
+            and self.row_count == len(df)
+            and (fingerprint is None or fingerprint == self.fingerprint)
+        )
+
+    def rows(self, column, values):
+        """
+        Returns the list of the sorted row id arrays of each of values found in
+        column or None if column is not indexed
+        """
+        codes = self._codes.get(column)
+        if codes is None:
+            return None
+        order, offsets, _ = self.columns[column]
+        r = []
+        for v in values:
+            c = codes.get(v)
+            if c is not None:
+                r.append(order[offsets[c] : offsets[c + 1]])
+        return r
+
+    def write(self, path):
+        d = {
+            "keys": np.array(list(self.columns.keys()), dtype=str),
+            "row_count": np.array(self.row_count),
+            "fingerprint": np.array(self.fingerprint, dtype=np.int64),
+        }
+        for i, (order, offsets, uniques) in enumerate(self.columns.values()):
+            d[f"order{i}"] = order
+            d[f"offsets{i}"] = offsets
+            d[f"uniques{i}"] = np.array(uniques)
+        # write to a temporary file first so that readers never see a partial index
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, **d)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def read(path, df):
+        """Reads the index of df from path. Returns None if it does not match df."""
+        try:
+            with np.load(path, allow_pickle=False) as d:
+                if int(d["row_count"]) != len(df):
+                    return None
+                columns = {}
+                for i, k in enumerate(d["keys"].tolist()):
+                    columns[k] = (
+                        d[f"order{i}"],
+                        d[f"offsets{i}"],
+                        d[f"uniques{i}"].tolist(),
+                    )
+                fingerprint = tuple(d["fingerprint"].tolist())
+        except Exception as e:
+            LOG.debug(f"cannot read inverted index={path} {e}")
+            return None
+        return InvertedIndex(df, columns, fingerprint=fingerprint)
+
+
+# the number of select() results cached by each index, 0 disables the cache
+SELECT_CACHE_SIZE = 32
+
+
+class SelectCache:
+    """
+    LRU cache of the select() results of an index keyed by the filter
+    conditions. The results are only valid for the blocks they were selected
+    from, so the cache is cleared when any block of the index is replaced,
+    e.g. when the blocks are reloaded, rescanned or keys are added.
+    """
+
+    def __init__(self, max_size=None):
+        self.max_size = SELECT_CACHE_SIZE if max_size is None else max_size
+        self._results = OrderedDict()
+        self._blocks = None
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._results)
+
+    def __str__(self):
+        return (
+            f"{self.__class__.__name__}[size={len(self)}, hits={self.hits}, "
+            f"misses={self.misses}, hit_rate={self.hit_rate:.2f}]"
+        )
+
+    @property
+    def hit_rate(self):
+        n = self.hits + self.misses
+        return self.hits / n if n > 0 else 0.0
+
+    @staticmethod
+    def make_key(dims):
+        """
+        Returns the key of the filter conditions made by IndexDb._make_dims()
+        or None if they are not hashable. The order and the repetitions of the
+        values do not change the result so they are not part of the key.
+        """
+        try:
+            key = tuple(
+                sorted(
+                    (
+                        k,
+                        (
+                            tuple(sorted(set(v), key=repr))
+                            if isinstance(v, (list, tuple))
+                            else v
+                        ),
+                    )
+                    for k, v in dims.items()
+                )
+            )
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def _check_blocks(self, blocks):
+        # the blocks are compared by identity, the references are kept so the
+        # ids cannot be reused
+        state = list(blocks.items())
+        if (
+            self._blocks is None
+            or len(state) != len(self._blocks)
+            or any(
+                k1 != k2 or df1 is not df2
+                for (k1, df1), (k2, df2) in zip(state, self._blocks)
+            )
+        ):
+            self._results.clear()
+            self._blocks = state
+
+    def get(self, key, blocks):
+        if self.max_size <= 0 or key is None:
+            return None
+        self._check_blocks(blocks)
+        r = self._results.get(key)
+        if r is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._results.move_to_end(key)
+        return r
+
+    def put(self, key, blocks, fs):
+        if self.max_size <= 0 or key is None:
+            return
+        self._check_blocks(blocks)
+        self._results[key] = fs
+        while len(self._results) > self.max_size:
+            self._results.popitem(last=False)
+
+    def clear(self):
+        self._results.clear()
+        self._blocks = None
+
+
 class IndexDb:
     ROOTDIR_PLACEHOLDER_TOKEN = "__ROOTDIR__"
 
@@ -68,6 +313,8 @@ class IndexDb:
         self.blocks = {} if blocks is None else blocks
         self.vector_loaded = False
         self._param_types = {}
+        self._inverted = {}
+        self.select_cache = SelectCache()
         self.data_files = [] if data_files is None else data_files
         self.merge_conf = [] if merge_conf is None else merge_conf
         self._params = {}
@@ -120,10 +367,23 @@ class IndexDb:
         # print(f"dims={dims}")
         self.load(keys=list(dims.keys()), vector=vector)
 
+        # the cached results are returned as new Fieldsets sharing the fields
+        cache_key = None
+        if getattr(self.fieldset_class, "view", None) is not None:
+            cache_key = SelectCache.make_key(
+                {**dims, "_named_vector_param": vector, "_max_count": max_count}
+            )
+            fs = self.select_cache.get(cache_key, self.blocks)
+            if fs is not None:
+                return fs.view()
+
         db, fs = self._get_fields(dims, max_count=max_count, vector=vector)
         fs._db = db
         # LOG.debug(f"fs={fs}")
         # print(f"blocks={fs._db.blocks}")
+        if cache_key is not None:
+            self.select_cache.put(cache_key, self.blocks, fs)
+            return fs.view()
         return fs
 
     def _get_fields(self, dims, max_count=-1, vector=False):
@@ -162,66 +422,159 @@ class IndexDb:
         if key in self.blocks:
             if self.blocks[key] is None:
                 self._load_block(key)
-            df = self._filter_df(df=self.blocks[key], dims=dims)
+            df = self._filter_df(df=self.blocks[key], dims=dims, key=key)
             # LOG.debug(f"df={df}")
             return df
         return None
 
-    def _build_query(self, dims, df):
-        q = ""
+    def _build_mask(self, dims, df):
+        """
+        Returns the boolean row mask of df matching all the conditions in dims
+        or None if there are no conditions. The mask of each condition is
+        cached by MASK_CACHE.
+        """
+        mask = None
         for column, v in dims.items():
-            # print(f"v={v}")
             if v:
-                col_type = None
-                if q:
-                    q += " and "
-
-                # datetime columns
-                if column in GribIndexer.DATETIME_KEYS:
-                    name_date = GribIndexer.DATETIME_KEYS[column][0]
-                    name_time = GribIndexer.DATETIME_KEYS[column][1]
-                    # here we should simply say: name_date*10000 + name_time. However,
-                    # pandas cannot handle it in the query because the column types are
-                    # Int64. np.int64 would work but that cannot handle missing values. So
-                    # we need to break down the condition into individual logical components!
-                    s = []
-                    for x in v:
-                        # print(f"x={x}")
-                        # print(" date=" + x.strftime("%Y%m%d"))
-                        # print(" time=" + x.strftime("%H%M"))
-                        s.append(
-                            f"(`{name_date}` == "
-                            + str(int(x.strftime("%Y%m%d")))
-                            + " and "
-                            + f"`{name_time}` == "
-                            + str(int(x.strftime("%H%M")))
-                            + ")"
-                        )
-                    q += "(" + " or ".join(s) + " ) "
-                else:
+                if not isinstance(v, list):
+                    v = [v]
+                m = MASK_CACHE.get(
+                    df,
+                    (column, tuple(v)),
+                    lambda: IndexDb._column_mask(df, column, v),
+                )
+                mask = m if mask is None else mask & m
+        return mask
+
+    @staticmethod
+    def _column_mask(df, column, v):
+        # datetime columns
+        if column in GribIndexer.DATETIME_KEYS:
+            # the date and time are combined into an Int64 yyyymmddHHMM column,
+            # which keeps the missing values
+            col = MASK_CACHE.get(
+                df, column, lambda: IndexDb._datetime_column(df, column)
+            )
+            v = [int(x.strftime("%Y%m%d%H%M")) for x in v]
+        else:
+            col = df[column]
+            col_type = df.dtypes[column]
+            v = [GribIndexer._convert_query_value(x, col_type) for x in v]
+        return col.isin(v).to_numpy(dtype=bool)
+
+    @staticmethod
+    def _datetime_column(df, column):
+        name_date, name_time = GribIndexer.DATETIME_KEYS[column]
+        return df[name_date].astype("Int64") * 10000 + df[name_time].astype("Int64")
+
+    def _inverted_index(self, key, df):
+        """
+        Returns the InvertedIndex of the block df. When the index is stored on
+        disk it is read from the file next to the block and written there
+        when built.
+        """
+        fingerprint = None
+        path = ""
+        if self.db_dir:
+            storage = GribIndexer._find_storage(key, self.db_dir)
+            block_path = storage.path(key, self.db_dir)
+            if os.path.exists(block_path):
+                st = os.stat(block_path)
+                fingerprint = (st.st_size, st.st_mtime_ns)
+                path = os.path.join(self.db_dir, f"{key}{InvertedIndex.SUFFIX}")
+
+        idx = self._inverted.get(key)
+        if idx is not None and idx.is_valid(df, fingerprint):
+            return idx
+
+        idx = None
+        if path and os.path.exists(path):
+            idx = InvertedIndex.read(path, df)
+            if idx is not None and idx.fingerprint != fingerprint:
+                idx = None
+        if idx is None:
+            idx = InvertedIndex.build(df, fingerprint=fingerprint)
+            if path:
+                try:
+                    idx.write(path)
+                except Exception as e:
+                    LOG.debug(f"cannot write inverted index={path} {e}")
+        self._inverted[key] = idx
+        return idx
+
+    def _build_rows(self, dims, df, idx):
+        """
+        Returns the sorted row ids of df matching all the conditions in dims
+        using the inverted index or None if there are no conditions. The
+        conditions on the columns not in the index are evaluated with masks.
+        """
+        found = []
+        masked = {}
+        for column, v in dims.items():
+            if v:
+                if not isinstance(v, list):
+                    v = [v]
+                r = None
+                if column in df.columns:
                     col_type = df.dtypes[column]
-                    column = f"`{column}`"
-                    if not isinstance(v, list):
-                        q += f"{column} == {GribIndexer._convert_query_value(v, col_type)}"
-                    else:
-                        v = [GribIndexer._convert_query_value(x, col_type) for x in v]
-                        q += f"{column} in {v}"
-        return q
+                    r = idx.rows(
+                        column,
+                        [GribIndexer._convert_query_value(x, col_type) for x in v],
+                    )
+                if r is None:
+                    masked[column] = v
+                else:
+                    found.append(r)
+
+        rows = None
+        if found:
+            # only the most selective condition is merged into a single array,
+            # the others are checked against it
+            found.sort(key=lambda x: sum(len(p) for p in x))
+            rows = IndexDb._union_rows(found[0])
+            for parts in found[1:]:
+                if len(rows) == 0:
+                    break
+                keep = np.zeros(len(rows), dtype=bool)
+                for p in parts:
+                    keep |= IndexDb._isin_rows(rows, p)
+                rows = rows[keep]
+        if masked:
+            mask = self._build_mask(masked, df)
+            rows = np.flatnonzero(mask) if rows is None else rows[mask[rows]]
+        return rows
 
-    def _filter_df(self, df=None, dims={}):
+    @staticmethod
+    def _union_rows(parts):
+        if len(parts) == 0:
+            return np.empty(0, dtype=np.int64)
+        elif len(parts) == 1:
+            return parts[0]
+        return np.unique(np.concatenate(parts))
+
+    @staticmethod
+    def _isin_rows(a, b):
+        # b is sorted
+        if len(b) == 0:
+            return np.zeros(len(a), dtype=bool)
+        pos = np.searchsorted(b, a)
+        pos[pos == len(b)] = 0
+        return b[pos] == a
+
+    def _filter_df(self, df=None, dims={}, key=None):
         if len(dims) == 0:
             return df
         else:
             df_res = None
             if df is not None:
-                # print("types={}".format(df.dtypes))
-                q = self._build_query(dims, df)
-                # print("query={}".format(q))
-                if q != "":
-                    df_res = df.query(q, engine="python")
-                    df_res.reset_index(drop=True, inplace=True)
-                    # print(f"df_res={df_res}")
-                    # LOG.debug(f"df_res={df_res}")
+                if INVERTED_INDEX and key is not None:
+                    rows = self._build_rows(dims, df, self._inverted_index(key, df))
+                    if rows is not None:
+                        return df.iloc[rows].reset_index(drop=True)
+                    return df
+                mask = self._build_mask(dims, df)
+                if mask is not None:
+                    df_res = df[mask].reset_index(drop=True)
                 else:
                     return df
             return df_res
@@ -231,7 +584,7 @@ class IndexDb:
         # LOG.debug(f"block={self.blocks[key]}")
         if self.blocks[key] is None:
             self._load_block(key)
-        df = self._filter_df(df=self.blocks[key], dims=dims)
+        df = self._filter_df(df=self.blocks[key], dims=dims, key=key)
         # print(f"df={df}")
         # LOG.debug(f"df={df}")
         if df is not None and not df.empty:
@@ -344,8 +697,12 @@ class FieldsetDb(IndexDb):
 
     def load(self, keys=[], vector=False):
         # print(f"blocks={self.blocks}")
-        if self.indexer.update_keys(keys):
-            self.blocks = {}
+        added = self.indexer.update_keys(keys)
+        if added and self.blocks:
+            # only the new columns are read
+            self._param_types = {}
+            self.indexer.add_keys(added)
+        elif added:
             self._param_types = {}
             self.scan(vector=self.vector_loaded)
         elif not self.blocks:
@@ -372,27 +729,27 @@ class FieldsetDb(IndexDb):
             return None
 
         # print(f"comp_num={comp_num}")
-        idx = [[] for k in range(comp_num)]
-        comp_lst = list(range(comp_num))
-        cnt = 0
-        for row in df.itertuples():
-            # print(f"{row}")
-            if max_count == -1 or len(fs) < max_count:
-                for comp in comp_lst:
-                    fs.append(self.fs[row[-1 - (comp_num - comp - 1)]])
-                    idx[comp].append(len(fs) - 1)
-                cnt += 1
-            else:
-                break
+        # the rows are taken as long as the result has fewer than max_count fields
+        cnt = df.shape[0]
+        if max_count != -1:
+            cnt = min(cnt, max(0, -(-(max_count - len(fs)) // comp_num)))
+
+        # the message indices of the components of each row, row by row
+        msg = df[[f"_msgIndex{k+1}" for k in range(comp_num)]].to_numpy(dtype=np.int64)[
+            :cnt
+        ]
+        start = len(fs)
+        fs.append(self._take(msg.ravel()))
 
         # generate a new dataframe
-        if max_count == -1 or cnt == df.shape[0]:
+        if cnt == df.shape[0]:
             df = df.copy()
         else:
             df = df.head(cnt).copy()
 
-        for k, v in enumerate(idx):
-            df[f"_msgIndex{k+1}"] = v
+        pos = start + np.arange(cnt, dtype=np.int64) * comp_num
+        for k in range(comp_num):
+            df[f"_msgIndex{k+1}"] = pos + k
         return df
 
     def _extract_scalar_fields(self, df):
@@ -403,16 +760,25 @@ class FieldsetDb(IndexDb):
         assert "_msgIndex2" not in df.columns
         assert "_msgIndex3" not in df.columns
 
-        fs = self.fieldset_class()
-        for row in df.itertuples():
-            fs.append(self.fs[row[-1]])
+        fs = self._take(df["_msgIndex1"].to_numpy(dtype=np.int64))
 
         assert len(fs) == len(df.index)
         # generate a new dataframe
         df = df.copy()
-        df["_msgIndex1"] = list(range(len(df.index)))
+        df["_msgIndex1"] = np.arange(len(df.index), dtype=np.int64)
         return df, fs
 
+    def _take(self, indices):
+        # only the Fieldsets implemented in Python provide take(). The class is
+        # checked since the binary Fieldset resolves any attribute to a Macro
+        # function.
+        if getattr(type(self.fs), "take", None) is not None:
+            return self.fs.take(indices)
+        fs = self.fieldset_class()
+        for i in indices:
+            fs.append(self.fs[int(i)])
+        return fs
+
     def _clone(self):
         db = FieldsetDb(self.name, label=self.label, regrid_from=self.regrid_from)
 
@@ -9,13 +9,18 @@
 # nor does it submit to any jurisdiction.
 #
 
+from collections import deque
 import copy
 import datetime
+import hashlib
 import logging
+import operator
 import os
 from pathlib import Path
 
+from . import metadata
 from . import utils
+from .executor import FieldExecutor
 import numpy as np
 import pandas as pd
 import yaml
@@ -27,6 +32,147 @@ LOG = logging.getLogger(__name__)
 NEWER = True
 
 
+class IndexStorage:
+    """
+    Base class of the on-disk formats of the index blocks. Each block is
+    stored in a file named after the block with the suffix of the format.
+    """
+
+    suffix = ""
+
+    def path(self, name, dir_name):
+        return os.path.join(dir_name, f"{name}{self.suffix}")
+
+    def key_list(self, dir_name):
+        r = []
+        for f in utils.get_file_list(os.path.join(dir_name, f"*{self.suffix}")):
+            name = os.path.basename(f)
+            r.append(name[: -len(self.suffix)])
+        return r
+
+    def write(self, df, path):
+        raise NotImplementedError
+
+    def read(self, path, columns=None):
+        raise NotImplementedError
+
+
+class CsvIndexStorage(IndexStorage):
+    """The gzip compressed csv format. The column types have to be parsed."""
+
+    suffix = ".csv.gz"
+
+    def write(self, df, path):
+        df.to_csv(path_or_buf=path, header=True, index=False, compression="gzip")
+
+    def read(self, path, columns=None):
+        return pd.read_csv(
+            path,
+            index_col=None,
+            usecols=columns,
+            dtype=GribIndexer.PREDEF_PD_TYPES,
+        )
+
+
+class NpzIndexStorage(IndexStorage):
+    """
+    Stores the columns as typed arrays in a compressed npz file. The
+    strings are stored as categorical codes and the nullable integers as
+    values with a mask. Only the requested columns are decompressed.
+    """
+
+    suffix = ".idx.npz"
+
+    def write(self, df, path):
+        d = {}
+        kinds = []
+        for c in df.columns:
+            col = df[c]
+            if pd.api.types.is_extension_array_dtype(
+                col
+            ) and pd.api.types.is_integer_dtype(col):
+                kinds.append("n")
+                d[f"{c}.mask"] = col.isna().to_numpy()
+                d[c] = col.to_numpy(dtype=col.dtype.numpy_dtype, na_value=0)
+            elif col.dtype == object:
+                kinds.append("c")
+                codes, uniques = pd.factorize(col)
+                d[c] = codes.astype(np.int32)
+                d[f"{c}.categories"] = np.array([str(x) for x in uniques], dtype=str)
+            else:
+                kinds.append("v")
+                d[c] = col.to_numpy()
+        d["_columns"] = np.array(list(df.columns), dtype=str)
+        d["_kinds"] = np.array(kinds, dtype=str)
+        d["_dtypes"] = np.array([str(x) for x in df.dtypes], dtype=str)
+        # a file object is used so that np.savez keeps the name
+        tmp = path + ".tmp"
+        try:
+            with open(tmp, "wb") as f:
+                np.savez_compressed(f, **d)
+            os.replace(tmp, path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def read(self, path, columns=None):
+        with np.load(path, allow_pickle=False) as d:
+            names = d["_columns"].tolist()
+            kinds = dict(zip(names, d["_kinds"].tolist()))
+            dtypes = dict(zip(names, d["_dtypes"].tolist()))
+            if columns is not None:
+                names = [c for c in names if c in columns]
+            data = {}
+            for c in names:
+                kind = kinds[c]
+                if kind == "n":
+                    data[c] = pd.arrays.IntegerArray(d[c], d[f"{c}.mask"])
+                    if str(data[c].dtype) != dtypes[c]:
+                        data[c] = data[c].astype(dtypes[c])
+                elif kind == "c":
+                    codes = d[c]
+                    v = d[f"{c}.categories"].astype(object)
+                    v = v[codes] if len(v) > 0 else np.empty(len(codes), dtype=object)
+                    v[codes < 0] = np.nan
+                    data[c] = v
+                else:
+                    data[c] = d[c]
+        return pd.DataFrame(data, columns=names)
+
+
+INDEX_STORAGES = {"csv": CsvIndexStorage(), "npz": NpzIndexStorage()}
+
+# the format of the newly written index blocks
+INDEX_STORAGE = "npz"
+
+
+def index_storage(name=None):
+    return INDEX_STORAGES[INDEX_STORAGE if name is None else name]
+
+
+# the number of bytes hashed at both ends of the data files to detect changes
+# not altering their size and modification time. 0 disables the hashing.
+FINGERPRINT_HASH_SIZE = 65536
+
+# the number of processes scanning the data files. 1 scans them serially.
+SCAN_WORKERS = 1
+
+# the number of scanned files between the progress messages
+SCAN_PROGRESS_STEP = 100
+
+
+def _scan_file(path, keys_ecc):
+    """
+    Returns the offsets, the lengths and the metadata columns of keys_ecc of
+    the messages in a data file. Only the headers of the messages are read.
+    """
+    offsets, lengths, cols = metadata.reader(keys_ecc).read_file(
+        path, headers_only=True
+    )
+    return offsets, lengths, [cols[k] for k in keys_ecc]
+
+
 class GribIndexer:
     VECTOR_PARAMS = {
         "wind10m": ["10u", "10v"],
@@ -139,7 +285,8 @@ class GribIndexer:
         self.pt_types = {k: v[2] for k, v in GribIndexer.DEFAULT_KEYS.items()}
 
     def update_keys(self, keys):
-        ret = False
+        """Adds the keys not indexed yet and returns the list of their names"""
+        ret = []
         for k in keys:
             name = k
             # we do not add datetime keys (they are pseudo keys, and their value
@@ -151,7 +298,7 @@ class GribIndexer:
                 self.keys_ecc.append(ecc_name)
                 self.pd_types[name] = p[1]
                 self.pt_types[name] = p[2]
-                ret = True
+                ret.append(name)
         return ret
 
     def _check_duplicates(self, name, df):
@@ -173,88 +320,37 @@ class GribIndexer:
 
     def _build_vector_index(self, df, v_name, v_comp):
         # LOG.debug(f"v_name={v_name} v_comp={v_comp}")
-        comp_num = len(v_comp)
 
         # filter components belonging together
         comp_df = []
-        for i, comp_name in enumerate(v_comp):
-            query = f"shortName == '{comp_name}'"
-            r = df.query(query, engine="python")
-            # if we do not use copy, the assignment below as:
-            # comp_df[0].loc[...
-            # generates the SettingWithCopyWarning warning!!!
-            if i == 0:
-                r = df.query(query, engine="python").copy()
-            else:
-                r = df.query(query, engine="python")
+        for comp_name in v_comp:
+            r = df[df["shortName"] == comp_name]
             if r.empty:
                 return []
-            else:
-                comp_df.append(r)
+            comp_df.append(r)
+
+        # pair up the components with a hash join on the columns that must
+        # match. Each row of the first component takes the first unused
+        # matching row of each of the other components.
+        match_key = operator.itemgetter(*self.wind_check_index)
+        comp_rows = []
+        for c in comp_df[1:]:
+            rows = {}
+            for row in c.itertuples(name=None):
+                rows.setdefault(match_key(row), deque()).append(row)
+            comp_rows.append(rows)
 
-        assert comp_num == len(comp_df)
-
-        # pair up components within a 2D vector field. This
-        # version proved to be the fastest!
-        # LOG.debug(" pair up collected components:")
-
-        # print(f"v_name={v_name} {len(comp_df[1].index)}")
-        # print("view=", comp_df[0]._is_view)
         r = []
-        used1 = np.full(len(comp_df[1].index), False, dtype="?")
-        comp_df[0].loc[:, "shortName"] = v_name
-        # 2D
-        if comp_num == 2:
-            for row0 in comp_df[0].itertuples(name=None):
-                i = 0
-                for row1 in comp_df[1].itertuples(name=None):
-                    if not used1[i]:
-                        b = True
-                        for x in self.wind_check_index:
-                            if row0[x] != row1[x]:
-                                b = False
-                                break
-                        if b:
-                            d = list(row0[1:])
-                            d.extend(row1[-self.ref_column_count :])
-                            r.append(d)
-                            used1[i] = True
-                            break
-                    i += 1
-        # 3D
-        elif comp_num == 3:
-            used2 = np.full(len(comp_df[2].index), False, dtype="?")
-            for row0 in comp_df[0].itertuples(name=None):
-                i = 0
-                for row1 in comp_df[1].itertuples(name=None):
-                    if not used1[i]:
-                        b = True
-                        for x in self.wind_check_index:
-                            if row0[x] != row1[x]:
-                                b = False
-                                break
-                        if b:
-                            j = 0
-                            for row2 in comp_df[2].itertuples(name=None):
-                                if not used2[j]:
-                                    b = True
-                                    for x in self.wind_check_index:
-                                        if row0[x] != row2[x]:
-                                            b = False
-                                            break
-                                    if b:
-                                        d = list(row0[1:])
-                                        d.extend(row1[-self.ref_column_count :])
-                                        d.extend(row2[-self.ref_column_count :])
-                                        r.append(d)
-                                        used1[i] = True
-                                        used2[j] = True
-                                        j = -1
-                                        break
-                                j += 1
-                            if j == -1:
-                                break
-                    i += 1
+        name_pos = comp_df[0].columns.get_loc("shortName")
+        for row0 in comp_df[0].itertuples(name=None):
+            key = match_key(row0)
+            matches = [rows.get(key) for rows in comp_rows]
+            if all(matches):
+                d = list(row0[1:])
+                d[name_pos] = v_name
+                for m in matches:
+                    d.extend(m.popleft()[-self.ref_column_count :])
+                r.append(d)
         return r
 
     def _make_dataframe(self, data, sort=False, columns=None):
@@ -285,28 +381,73 @@ class GribIndexer:
         return df
 
     def _write_dataframe(self, df, name, out_dir):
-        f_name = os.path.join(out_dir, f"{name}.csv.gz")
-        df.to_csv(path_or_buf=f_name, header=True, index=False, compression="gzip")
+        storage = index_storage()
+        storage.write(df, storage.path(name, out_dir))
+        # the block is replaced in all the formats
+        GribIndexer._remove_block(name, out_dir, keep=storage)
 
     @staticmethod
-    def read_dataframe(key, dir_name):
+    def _remove_block(name, dir_name, keep=None):
+        for storage in INDEX_STORAGES.values():
+            f_name = storage.path(name, dir_name)
+            if storage is not keep and os.path.exists(f_name):
+                os.remove(f_name)
+
+    @staticmethod
+    def _find_storage(key, dir_name):
+        # the blocks in other formats are read as they are, only
+        # migrate_storage() converts them
+        storage = index_storage()
+        if not os.path.exists(storage.path(key, dir_name)):
+            for s in INDEX_STORAGES.values():
+                if os.path.exists(s.path(key, dir_name)):
+                    return s
+        return storage
+
+    @staticmethod
+    def read_dataframe(key, dir_name, columns=None):
         # assert len(key) == len(GribIndexer.BLOCK_KEYS)
-        name = key
-        f_name = os.path.join(dir_name, f"{name}.csv.gz")
+        storage = GribIndexer._find_storage(key, dir_name)
+        f_name = storage.path(key, dir_name)
         # LOG.debug("f_name={}".format(f_name))
-        return pd.read_csv(f_name, index_col=None, dtype=GribIndexer.PREDEF_PD_TYPES)
+        return storage.read(f_name, columns=columns)
 
     @staticmethod
     def get_storage_key_list(dir_name):
-        r = []
         # LOG.debug(f"dir_name={dir_name}")
-        suffix = ".csv.gz"
-        for f in utils.get_file_list(os.path.join(dir_name, f"*{suffix}")):
-            name = os.path.basename(f)
-            # LOG.debug(f"name={name}")
-            r.append(name[: -len(suffix)])
+        r = index_storage().key_list(dir_name)
+        for storage in INDEX_STORAGES.values():
+            r.extend([k for k in storage.key_list(dir_name) if k not in r])
         return r
 
+    @staticmethod
+    def migrate_storage(dir_name):
+        """
+        Converts the index blocks stored in any other format into the current
+        one. The old files are removed once converted. Nothing is changed in
+        a read-only directory, the blocks in other formats can be read as they
+        are. Returns True when all the blocks are in the current format.
+        """
+        if not os.access(dir_name, os.W_OK):
+            return False
+        storage = index_storage()
+        keys = set(storage.key_list(dir_name))
+        for name, old in INDEX_STORAGES.items():
+            if old is storage:
+                continue
+            for key in old.key_list(dir_name):
+                old_path = old.path(key, dir_name)
+                try:
+                    if key not in keys:
+                        LOG.info(f"migrate index block={old_path} to {storage.suffix}")
+                        storage.write(old.read(old_path), storage.path(key, dir_name))
+                        keys.add(key)
+                    os.remove(old_path)
+                except OSError as e:
+                    LOG.warning(f"cannot migrate index block={old_path}: {e}")
+                    return False
+        return True
+
     @staticmethod
     def is_key_wind(key):
         return key in GribIndexer.VECTOR_PARAMS
@@ -448,7 +589,7 @@ class FieldsetIndexer(GribIndexer):
         # print(f"fs_len={len(fs)}")
         # print(f"keys_ecc={self.keys_ecc}")
         if utils.is_fieldset_type(fs) and len(fs) > 0:
-            md_vals = fs.grib_get(self.keys_ecc, "key")
+            md_vals = self._read_keys(fs, self.keys_ecc)
             if mapped_params:
                 for i in range(len(fs)):
                     v = md_vals[self.param_id_index][i]
@@ -462,6 +603,38 @@ class FieldsetIndexer(GribIndexer):
             LOG.info(f" {len(fs)} GRIB messages processed")
         return data
 
+    @staticmethod
+    def _read_keys(fs, keys_ecc):
+        if getattr(type(fs), "grib_get_columns", None) is not None:
+            # the messages not loaded yet are only read up to the data section
+            cols = fs.grib_get_columns(keys_ecc, headers_only=True)
+            return [cols[k] for k in keys_ecc]
+        return fs.grib_get(keys_ecc, "key")
+
+    def add_keys(self, keys):
+        """
+        Reads the values of the newly added keys only and inserts them into
+        the existing blocks before the message index columns. The vector
+        blocks are kept since the components are only paired on the default
+        keys.
+        """
+        fs = self.db.fs
+        keys_ecc = [self.keys_ecc[self.keys.index(k)] for k in keys]
+        LOG.info(f" add keys={keys} ...")
+        md_vals = self._read_keys(fs, keys_ecc)
+        cols = pd.DataFrame(dict(zip(keys, md_vals)))
+        cols = cols.astype({k: self.pd_types[k] for k in keys})
+        pos = len(self.keys) - len(keys)
+        for name, df in self.db.blocks.items():
+            if df is not None:
+                idx = df["_msgIndex1"].to_numpy()
+                # a new DataFrame so the filters cached for the former one are
+                # not used
+                df = df.copy()
+                for i, k in enumerate(keys):
+                    df.insert(pos + i, k, cols[k].array.take(idx))
+                self.db.blocks[name] = df
+
     def _scan_vector(self):
         df = self.db.blocks["scalar"]
         if df is not None and not df.empty:
@@ -481,18 +654,40 @@ class FieldsetIndexer(GribIndexer):
 
 
 class ExperimentIndexer(GribIndexer):
+    FINGERPRINT_FILE = "fingerprints.yaml"
+    # the columns locating the message of each component
+    REF_COLUMNS = ["_msgIndex", "_fileIndex", "_offset", "_length"]
+
     def __init__(self, *args):
         super().__init__(*args)
-        self.ref_column_count = 2
+        self.ref_column_count = len(self.REF_COLUMNS)
 
-    def scan(self):
+    def scan(self, incremental=True, workers=None, progress=None):
+        """
+        Generates the index. With incremental only the new and changed data
+        files are scanned, the rows of the other files are taken from the
+        existing index. With workers > 1 (SCAN_WORKERS by default) the files
+        are scanned in a process pool. progress is called with the number of
+        scanned and all the files to scan.
+        """
         out_dir = self.db.db_dir
         Path(out_dir).mkdir(exist_ok=True, parents=True)
         LOG.info(f"scan {self.db} out_dir={out_dir} ...")
 
-        data = {k: [] for k in [*self.keys, "_msgIndex1", "_fileIndex1"]}
+        data = {k: [] for k in [*self.keys, *[f"{c}1" for c in self.REF_COLUMNS]]}
         input_files = []
 
+        previous, prev_df = {}, None
+        if incremental:
+            previous, prev_df = self._read_previous_scan(out_dir)
+        # the fingerprints are only valid once all the blocks are written
+        fp_path = os.path.join(out_dir, self.FINGERPRINT_FILE)
+        if os.path.exists(fp_path):
+            os.remove(fp_path)
+        # old file index -> new file index of the files not scanned again
+        reused = {}
+        fingerprints = {}
+
         # print(f"out_dir={out_dir}")
         # merge existing experiment objects
         if self.db.merge_conf:
@@ -541,6 +736,11 @@ class ExperimentIndexer(GribIndexer):
                         data=data,
                         rootdir_placeholder_value=c["data"].rootdir_placeholder_value,
                         rootdir_placeholder_token=self.db.ROOTDIR_PLACEHOLDER_TOKEN,
+                        previous=previous,
+                        reused=reused,
+                        fingerprints=fingerprints,
+                        workers=workers,
+                        progress=progress,
                     )
         # index a single experiment
         else:
@@ -553,10 +753,15 @@ class ExperimentIndexer(GribIndexer):
                 data=data,
                 rootdir_placeholder_value=self.db.rootdir_placeholder_value,
                 rootdir_placeholder_token=self.db.ROOTDIR_PLACEHOLDER_TOKEN,
+                previous=previous,
+                reused=reused,
+                fingerprints=fingerprints,
+                workers=workers,
+                progress=progress,
             )
 
         # print(f"input_files={input_files}")
-        if len(input_files) > 0 and len(data["shortName"]) > 0:
+        if len(input_files) > 0 and (len(data["shortName"]) > 0 or reused):
             # write config file for input file list
             LOG.info(f"generate datafiles.yaml ...")
             f_name = os.path.join(out_dir, "datafiles.yaml")
@@ -567,7 +772,17 @@ class ExperimentIndexer(GribIndexer):
 
             # scalar
             LOG.info(f"generate scalar fields index ...")
-            df = self._make_dataframe(data, sort=True)
+            df = self._make_dataframe(data)
+            if reused:
+                LOG.info(f" {len(reused)} files taken from the existing index")
+                old_df = prev_df[prev_df["_fileIndex1"].isin(list(reused.keys()))]
+                old_df = old_df.assign(
+                    _fileIndex1=old_df["_fileIndex1"]
+                    .map(reused)
+                    .astype(prev_df["_fileIndex1"].dtype)
+                )
+                df = pd.concat([x for x in [old_df, df] if not x.empty])
+            df = GribIndexer._sort_dataframe(df)
             self.db.blocks["scalar"] = df
             self._write_dataframe(df, "scalar", out_dir)
 
@@ -579,15 +794,51 @@ class ExperimentIndexer(GribIndexer):
                 if r:
                     cols = [*self.keys]
                     for i in range(comp_num):
-                        cols.extend([f"_msgIndex{i+1}", f"_fileIndex{i+1}"])
+                        cols.extend([f"{c}{i+1}" for c in self.REF_COLUMNS])
                     w_df = self._make_dataframe(r, sort=True, columns=cols)
                     # print(f"wind_len={len(w_df.index)}")
                     self.db.blocks[v_name] = w_df
                     self._write_dataframe(w_df, v_name, out_dir)
                 else:
                     LOG.debug(" No paired fields found!")
+                    # a block left by a former scan
+                    self.db.blocks.pop(v_name, None)
+                    self._remove_block(v_name, out_dir)
                     continue
 
+            with open(fp_path, "w") as f:
+                yaml.dump(
+                    {"conf": self._conf_id(), "files": fingerprints},
+                    f,
+                    default_flow_style=False,
+                )
+
+    def _conf_id(self):
+        # the settings the rows of the index depend on
+        r = repr(
+            (self.keys_ecc, self.REF_COLUMNS, self.db.mapped_params, self.db.merge_conf)
+        )
+        return hashlib.md5(r.encode()).hexdigest()
+
+    def _read_previous_scan(self, out_dir):
+        """
+        Returns the fingerprint and the former file index of each data file
+        and the scalar block of the existing index
+        """
+        try:
+            with open(os.path.join(out_dir, self.FINGERPRINT_FILE), "r") as f:
+                conf = yaml.safe_load(f)
+            if conf.get("conf") != self._conf_id():
+                return {}, None
+            with open(os.path.join(out_dir, "datafiles.yaml"), "r") as f:
+                files = {x: i for i, x in enumerate(yaml.safe_load(f))}
+            df = ExperimentIndexer.read_dataframe("scalar", out_dir)
+        except Exception as e:
+            LOG.debug(f"cannot use the existing index in {out_dir}: {e}")
+            return {}, None
+        # the files not in the index contain no fields
+        return {k: (v, files.get(k)) for k, v in conf["files"].items()}, df
+
     def _scan_one(
         self,
         input_dir="",
@@ -598,43 +849,95 @@ class ExperimentIndexer(GribIndexer):
         data={},
         rootdir_placeholder_value="",
         rootdir_placeholder_token=None,
+        previous=None,
+        reused=None,
+        fingerprints=None,
+        workers=None,
+        progress=None,
     ):
+        previous = {} if previous is None else previous
+        reused = {} if reused is None else reused
+        fingerprints = {} if fingerprints is None else fingerprints
         LOG.info("scan fields ...")
         LOG.info(f" input_dir={input_dir} file_name_pattern={file_name_pattern}")
         # print(f" input_dir={input_dir} file_name_pattern={file_name_pattern}")
 
-        # for f_path in glob.glob(f_pattern):
-        cnt = 0
-        input_files_tmp = []
+        # the files to scan and the former file index of the ones already in
+        # the index
+        f_paths = []
+        to_scan = []
         for f_path in utils.get_file_list(
             input_dir, file_name_pattern=file_name_pattern
         ):
             # LOG.debug(f"  f_path={f_path}")
-            fs = self.db.fieldset_class(path=f_path)
-            if utils.is_fieldset_type(fs) and len(fs) > 0:
-                cnt += 1
-                input_files_tmp.append(f_path)
-                file_index = len(input_files) + len(input_files_tmp) - 1
-                md_vals = fs.grib_get(self.keys_ecc, "key")
-
-                if mapped_params:
-                    for i in range(len(fs)):
-                        v = md_vals[self.param_id_index][i]
-                        if v in mapped_params:
-                            short_name = mapped_params[v]
-                            md_vals[self.shortname_index][i] = short_name
-                if ens:
-                    for i in range(len(fs)):
-                        md_vals[self.type_index][i] = ens["type"]
-                        md_vals[self.number_index][i] = ens["number"]
-
-                assert len(self.keys) == len(self.keys_ecc)
-                for i, c in enumerate(self.keys):
-                    data[c].extend(md_vals[i])
-                data["_msgIndex1"].extend(list(range(len(fs))))
-                data["_fileIndex1"].extend([file_index] * len(fs))
-
-                # print({k: len(v) for k, v in data.items()})
+            stored_path = f_path
+            if rootdir_placeholder_value:
+                stored_path = f_path.replace(
+                    rootdir_placeholder_value, rootdir_placeholder_token
+                )
+            fp = utils.file_fingerprint(f_path, hash_size=FINGERPRINT_HASH_SIZE)
+            fingerprints[stored_path] = fp
+            prev = previous.get(stored_path)
+            if prev is not None and prev[0] == fp:
+                if prev[1] is not None:
+                    f_paths.append((f_path, prev[1]))
+            else:
+                f_paths.append((f_path, None))
+                to_scan.append(f_path)
+
+        # the files are scanned independently and the results are merged in
+        # file order so the file indexes do not depend on the workers
+        workers = SCAN_WORKERS if workers is None else workers
+        executor = FieldExecutor(
+            kind="process" if workers > 1 else "serial", max_workers=workers
+        )
+        try:
+            results = executor.imap(_scan_file, to_scan, [self.keys_ecc] * len(to_scan))
+            cnt = 0
+            scanned = 0
+            input_files_tmp = []
+            for f_path, old_index in f_paths:
+                if old_index is not None:
+                    cnt += 1
+                    input_files_tmp.append(f_path)
+                    reused[old_index] = len(input_files) + len(input_files_tmp) - 1
+                    continue
+
+                offsets, lengths, md_vals = next(results)
+                num = len(offsets)
+                scanned += 1
+                if progress is not None:
+                    progress(scanned, len(to_scan))
+                if scanned % SCAN_PROGRESS_STEP == 0:
+                    LOG.info(f" {scanned}/{len(to_scan)} files scanned")
+
+                if num > 0:
+                    cnt += 1
+                    input_files_tmp.append(f_path)
+                    file_index = len(input_files) + len(input_files_tmp) - 1
+
+                    if mapped_params:
+                        for i in range(num):
+                            v = md_vals[self.param_id_index][i]
+                            if v in mapped_params:
+                                short_name = mapped_params[v]
+                                md_vals[self.shortname_index][i] = short_name
+                    if ens:
+                        for i in range(num):
+                            md_vals[self.type_index][i] = ens["type"]
+                            md_vals[self.number_index][i] = ens["number"]
+
+                    assert len(self.keys) == len(self.keys_ecc)
+                    for i, c in enumerate(self.keys):
+                        data[c].extend(md_vals[i])
+                    data["_msgIndex1"].extend(list(range(num)))
+                    data["_fileIndex1"].extend([file_index] * num)
+                    data["_offset1"].extend(offsets)
+                    data["_length1"].extend(lengths)
+
+                    # print({k: len(v) for k, v in data.items()})
+        finally:
+            executor.shutdown()
 
         if rootdir_placeholder_value:
             input_files_tmp = [
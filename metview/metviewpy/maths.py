@@ -155,6 +155,8 @@ def mod(x, y):
 
 
 def bitmap(x, y):
+    # x can be the values cached in a Field so it must not be modified
+    x = x.copy()
     if isinstance(y, (int, float)):
         x[x == y] = np.nan
         return x
@@ -164,5 +166,6 @@ def bitmap(x, y):
 
 
 def nobitmap(x, y):
+    x = x.copy()
     x[np.isnan(x)] = y
     return x
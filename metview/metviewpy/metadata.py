@@ -0,0 +1,178 @@
+# (C) Copyright 2017- ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation
+# nor does it submit to any jurisdiction.
+#
+
+from functools import lru_cache
+
+import numpy as np
+import eccodes
+
+# key type suffix -> ecCodes getter
+GETTERS = {
+    "s": eccodes.codes_get_string,
+    "l": eccodes.codes_get_long,
+    "d": eccodes.codes_get_double,
+    "la": eccodes.codes_get_long_array,
+    "da": eccodes.codes_get_double_array,
+    "n": eccodes.codes_get,
+    "na": eccodes.codes_get_array,
+}
+
+
+class KeySpec:
+    """
+    A parsed key specification like "level:l". Keys without a type suffix are
+    read as strings. A native ("n") key with more than one value is read as
+    an array.
+    """
+
+    __slots__ = ["spec", "key", "key_type", "name", "getter"]
+
+    def __init__(self, spec):
+        self.spec = spec
+        parts = spec.split(":")
+        if len(parts) == 2:
+            self.key, self.key_type = parts
+        else:
+            self.key, self.key_type = spec, "s"
+        # the name with the type always present
+        self.name = f"{self.key}:{self.key_type}"
+        self.getter = GETTERS.get(self.key_type)
+        if self.getter is None:
+            raise ValueError(f"Unsupported key type={self.key_type} in key={spec}")
+
+    def get(self, handle):
+        """Returns the value of the key in the ecCodes handle or None"""
+        try:
+            if self.key_type == "n" and eccodes.codes_get_size(handle, self.key) > 1:
+                return eccodes.codes_get_array(handle, self.key)
+            return self.getter(handle, self.key)
+        except Exception:
+            return None
+
+
+class MetadataReader:
+    """
+    Reads the values of a list of keys from many GRIB messages. The key
+    specifications are parsed only once and the results can be returned
+    grouped by key, i.e. in columns.
+    """
+
+    def __init__(self, keys):
+        self.keys = list(keys)
+        self.specs = [KeySpec(k) for k in self.keys]
+
+    def get(self, handle):
+        """Returns the list of values for an ecCodes handle"""
+        return [s.get(handle) for s in self.specs]
+
+    def read_handles(self, handles, as_numpy=False):
+        """Returns a dict of the column of values for each key"""
+        cols = [[] for _ in self.specs]
+        for h in handles:
+            for c, s in zip(cols, self.specs):
+                c.append(s.get(h))
+        return self._make_columns(cols, as_numpy)
+
+    def read_file(self, path, headers_only=True, as_numpy=False):
+        """
+        Returns the offsets, the lengths and the columns of values for each
+        message in a GRIB file. With headers_only the data section is not
+        loaded so keys depending on the values cannot be read.
+        """
+        offsets = []
+        lengths = []
+        cols = [[] for _ in self.specs]
+        with open(path, "rb") as f:
+            while True:
+                h = eccodes.codes_new_from_file(
+                    f, eccodes.CODES_PRODUCT_GRIB, headers_only=headers_only
+                )
+                if h is None:
+                    break
+                try:
+                    offsets.append(eccodes.codes_get_message_offset(h))
+                    lengths.append(eccodes.codes_get_message_size(h))
+                    for c, s in zip(cols, self.specs):
+                        c.append(s.get(h))
+                finally:
+                    eccodes.codes_release(h)
+        return offsets, lengths, self._make_columns(cols, as_numpy)
+
+    def read_messages(self, path, offsets):
+        """
+        Returns the list of the columns of values for the messages at offsets
+        in a GRIB file. Only the headers of the messages are loaded.
+        """
+        cols = [[] for _ in self.specs]
+        with open(path, "rb") as f:
+            for offset in offsets:
+                f.seek(offset)
+                h = eccodes.codes_new_from_file(
+                    f, eccodes.CODES_PRODUCT_GRIB, headers_only=True
+                )
+                if h is None:
+                    raise ValueError(f"No GRIB message at offset={offset} in {path}")
+                try:
+                    for c, s in zip(cols, self.specs):
+                        c.append(s.get(h))
+                finally:
+                    eccodes.codes_release(h)
+        return cols
+
+    def _make_columns(self, cols, as_numpy):
+        if as_numpy:
+            cols = [to_array(c, s.key_type) for c, s in zip(cols, self.specs)]
+        return dict(zip(self.keys, cols))
+
+
+def to_array(values, key_type):
+    """
+    Converts a column of values into an ndarray. Missing values become nan in
+    float columns. Integer columns with missing values and all the other
+    columns have object dtype.
+    """
+    if key_type == "d":
+        return np.array([np.nan if v is None else v for v in values], dtype=float)
+    if key_type == "l" and all(v is not None for v in values):
+        return np.array(values, dtype=np.int64)
+    v = np.empty(len(values), dtype=object)
+    v[:] = values
+    return v
+
+
+# key types whose values are small enough to be cached in the Fields
+CACHED_KEY_TYPES = {"s", "l", "d", "n"}
+
+
+class CacheStats:
+    """Counts the key values served from and missing in the Field caches"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.hits = 0
+        self.misses = 0
+
+    def __str__(self):
+        return f"{self.__class__.__name__}[hits={self.hits}, misses={self.misses}]"
+
+
+CACHE_STATS = CacheStats()
+
+
+@lru_cache(maxsize=256)
+def _cached_reader(keys):
+    return MetadataReader(keys)
+
+
+def reader(keys):
+    """Returns the MetadataReader for keys, reusing the already parsed ones"""
+    return _cached_reader(tuple(keys))
@@ -0,0 +1,125 @@
+# (C) Copyright 2017- ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation
+# nor does it submit to any jurisdiction.
+#
+
+from functools import partial
+
+import numpy as np
+
+from . import executor
+
+# number of fields decoded together by a reduction
+REDUCTION_CHUNK_SIZE = 8
+
+
+def _sum_partial(v):
+    return (v.shape[0], v.sum(axis=0))
+
+
+def _sum_combine(a, b):
+    return (a[0] + b[0], a[1] + b[1])
+
+
+def _sumsq_partial(v):
+    return (v.shape[0], np.square(v).sum(axis=0))
+
+
+def _moments_partial(v):
+    m = v.mean(axis=0)
+    return (v.shape[0], m, np.square(v - m).sum(axis=0))
+
+
+def _moments_combine(a, b):
+    # Chan et al. parallel update of the Welford mean and M2
+    n = a[0] + b[0]
+    delta = b[1] - a[1]
+    mean = a[1] + delta * (b[0] / n)
+    m2 = a[2] + b[2] + np.square(delta) * (a[0] * b[0] / n)
+    return (n, mean, m2)
+
+
+def _min_partial(v):
+    return (v.shape[0], v.min(axis=0))
+
+
+def _min_combine(a, b):
+    return (a[0] + b[0], np.minimum(a[1], b[1]))
+
+
+def _max_partial(v):
+    return (v.shape[0], v.max(axis=0))
+
+
+def _max_combine(a, b):
+    return (a[0] + b[0], np.maximum(a[1], b[1]))
+
+
+# name -> (partial aggregate of a chunk, combine two aggregates, final result)
+REDUCTIONS = {
+    "sum": (_sum_partial, _sum_combine, lambda a: a[1]),
+    "mean": (_moments_partial, _moments_combine, lambda a: a[1]),
+    "var": (_moments_partial, _moments_combine, lambda a: a[2] / a[0]),
+    "stdev": (_moments_partial, _moments_combine, lambda a: np.sqrt(a[2] / a[0])),
+    "rms": (_sumsq_partial, _sum_combine, lambda a: np.sqrt(a[1] / a[0])),
+    "min": (_min_partial, _min_combine, lambda a: a[1]),
+    "max": (_max_partial, _max_combine, lambda a: a[1]),
+}
+
+
+def _decode(fields):
+    """Decodes the values of fields into a float64 2D array"""
+    v = None
+    for i, f in enumerate(fields):
+        x = f.values()
+        if v is None:
+            v = np.empty((len(fields), len(x)), dtype=np.float64)
+        v[i] = x
+    return v
+
+
+def _reduce_chunk(fields, func):
+    return func(_decode(fields))
+
+
+def reduce_fields(fields, name, chunk_size=None):
+    """
+    Computes the reduction called name along the field axis. The fields are
+    decoded in chunks, each reduced into a partial aggregate by the executor.
+    The partial aggregates are combined pairwise, so at any time only one
+    chunk per worker and O(log n) aggregates are kept in memory.
+    """
+    partial_func, combine, finalise = REDUCTIONS[name]
+    chunk_size = REDUCTION_CHUNK_SIZE if chunk_size is None else chunk_size
+    chunks = [fields[i : i + chunk_size] for i in range(0, len(fields), chunk_size)]
+
+    # only as many chunks as workers are dispatched at once
+    batch_size = executor.EXECUTOR.batch_size
+
+    func = partial(_reduce_chunk, func=partial_func)
+    stack = []
+    for start in range(0, len(chunks), batch_size):
+        for agg in executor.map_fields(func, chunks[start : start + batch_size]):
+            level = 0
+            while stack and stack[-1][0] == level:
+                agg = combine(stack.pop()[1], agg)
+                level += 1
+            stack.append((level, agg))
+
+    agg = stack.pop()[1]
+    while stack:
+        agg = combine(stack.pop()[1], agg)
+    return finalise(agg)
+
+
+def percentile_fields(fields, percentiles):
+    """
+    Computes the percentiles along the field axis. Unlike the other
+    reductions it needs the values of all the fields at once.
+    """
+    return np.percentile(_decode(fields), percentiles, axis=0)
@@ -0,0 +1,133 @@
+# (C) Copyright 2017- ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation
+# nor does it submit to any jurisdiction.
+#
+
+import hashlib
+import logging
+import os
+import tempfile
+
+import numpy as np
+
+from .indexer import GribIndexer
+from . import utils
+
+LOG = logging.getLogger(__name__)
+
+SIDECAR_SUFFIX = ".mpyidx"
+SIDECAR_VERSION = 1
+
+# When None the sidecar is written next to the GRIB file if its directory is
+# writable, otherwise into CACHE_DIR. When set, all the sidecars go there.
+SIDECAR_DIR = None
+CACHE_DIR = os.path.join(utils.CACHE_DIR, "sidecar")
+
+
+class SidecarIndex:
+    """
+    Stores the offset, length and the default indexer keys of each message in
+    a GRIB file. The sidecar is only valid while the size, mtime and inode of
+    the GRIB file are unchanged.
+    """
+
+    KEYS = GribIndexer.DEFAULT_ECC_KEYS
+
+    def __init__(self, path, offsets, lengths, header):
+        self.path = path
+        self.offsets = offsets
+        self.lengths = lengths
+        self.header = header
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def refs(self):
+        return [
+            (self.path, int(offset), int(length))
+            for offset, length in zip(self.offsets, self.lengths)
+        ]
+
+    def headers(self):
+        """Returns a dict of the header values for each message"""
+        cols = [self.header[k] for k in self.KEYS]
+        return [dict(zip(self.KEYS, v)) for v in zip(*cols)]
+
+    @staticmethod
+    def fingerprint(path):
+        st = os.stat(path)
+        return np.array([st.st_size, st.st_mtime_ns, st.st_ino], dtype=np.int64)
+
+    @staticmethod
+    def sidecar_path(path):
+        path = os.path.abspath(path)
+        if SIDECAR_DIR is None and os.access(os.path.dirname(path), os.W_OK):
+            return path + SIDECAR_SUFFIX
+        name = hashlib.md5(path.encode()).hexdigest() + SIDECAR_SUFFIX
+        return os.path.join(SIDECAR_DIR or CACHE_DIR, name)
+
+    @staticmethod
+    def load(path):
+        """Returns the sidecar of path or None if it does not exist or is stale"""
+        f_name = SidecarIndex.sidecar_path(path)
+        if not os.path.exists(f_name):
+            return None
+        try:
+            with np.load(f_name, allow_pickle=False) as d:
+                if (
+                    int(d["version"]) != SIDECAR_VERSION
+                    or list(d["keys"]) != SidecarIndex.KEYS
+                    or not np.array_equal(
+                        d["fingerprint"], SidecarIndex.fingerprint(path)
+                    )
+                ):
+                    return None
+                header = {}
+                for i, k in enumerate(SidecarIndex.KEYS):
+                    v = d[f"value{i}"].tolist()
+                    for j in np.flatnonzero(d[f"missing{i}"]):
+                        v[j] = None
+                    header[k] = v
+                return SidecarIndex(path, d["offsets"], d["lengths"], header)
+        except Exception as e:
+            LOG.warning(f"Cannot read sidecar index={f_name}: {e}")
+            return None
+
+    def write(self):
+        arrays = {
+            "version": np.array(SIDECAR_VERSION),
+            "fingerprint": SidecarIndex.fingerprint(self.path),
+            "keys": np.array(SidecarIndex.KEYS),
+            "offsets": np.asarray(self.offsets, dtype=np.int64),
+            "lengths": np.asarray(self.lengths, dtype=np.int64),
+        }
+        for i, k in enumerate(SidecarIndex.KEYS):
+            v = self.header[k]
+            missing = np.array([x is None for x in v], dtype=bool)
+            key_type = k.split(":")[1]
+            if key_type == "l":
+                v = np.array([0 if x is None else x for x in v], dtype=np.int64)
+            elif key_type == "d":
+                v = np.array([np.nan if x is None else x for x in v], dtype=float)
+            else:
+                v = np.array(["" if x is None else str(x) for x in v], dtype=str)
+            arrays[f"value{i}"] = v
+            arrays[f"missing{i}"] = missing
+
+        f_name = SidecarIndex.sidecar_path(self.path)
+        try:
+            out_dir = os.path.dirname(f_name)
+            os.makedirs(out_dir, exist_ok=True)
+            # write into a temporary file first so that concurrent readers
+            # never see a partially written sidecar
+            fd, tmp_name = tempfile.mkstemp(dir=out_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_name, f_name)
+        except Exception as e:
+            LOG.warning(f"Cannot write sidecar index={f_name}: {e}")
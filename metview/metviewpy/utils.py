@@ -10,8 +10,10 @@
 #
 
 import datetime
+from functools import partial
 import getpass
 import glob
+import hashlib
 import logging
 import math
 from pathlib import Path
@@ -22,6 +24,8 @@ import tempfile
 
 import numpy as np
 
+from . import executor
+
 LOG = logging.getLogger(__name__)
 
 
@@ -197,6 +201,24 @@ def has_globbing(text):
         return False
 
 
+def file_fingerprint(path, hash_size=0):
+    """
+    Returns the size, modification time and inode of a file. With hash_size > 0
+    the md5 hash of the first and last hash_size bytes is added.
+    """
+    st = os.stat(path)
+    r = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "inode": st.st_ino}
+    if hash_size > 0:
+        m = hashlib.md5()
+        with open(path, "rb") as f:
+            m.update(f.read(hash_size))
+            if st.st_size > hash_size:
+                f.seek(max(hash_size, st.st_size - hash_size))
+                m.update(f.read())
+        r["hash"] = m.hexdigest()
+    return r
+
+
 def unpack(file_path, remove=False):
     if any(file_path.endswith(x) for x in [".tar", ".tar.gz", ".tar.bz2"]):
         target_dir = os.path.dirname(file_path)
@@ -232,6 +254,12 @@ def simple_download(url, target):
     open(target, "wb").write(r.content)
 
 
+def _smooth_values(val, repeat, m_func, m_arg, kwargs):
+    for _ in range(repeat):
+        val = m_func(val, m_arg, **kwargs)
+    return val
+
+
 def _smooth_core(fs, repeat, m_func, m_arg, **kwargs):
     """
     Performs spatial smoothing on each field in fs with the given callable
@@ -242,15 +270,29 @@ def _smooth_core(fs, repeat, m_func, m_arg, **kwargs):
     # the resulting fieldset. We cannot use the Fieldset constructor here!
     res = type(fs)()
 
-    # build result in a loop
-    for fld, fld_meta in zip(fs, meta):
-        # smoothing only works for regular latlon grids
-        if fld_meta[0] == "regular_ll":
-            ncol = int(fld_meta[1])
-            val = fld.values()
-            val = np.reshape(val, (-1, ncol))
-            for _ in range(repeat):
-                val = m_func(val, m_arg, **kwargs)
+    # Only the smoothing itself is dispatched to the executor, the fieldset
+    # functions are called from this thread. The fields are processed in
+    # batches to limit the number of value arrays kept in memory.
+    func = partial(
+        _smooth_values, repeat=repeat, m_func=m_func, m_arg=m_arg, kwargs=kwargs
+    )
+    batch_size = executor.EXECUTOR.batch_size
+    for start in range(0, len(meta), batch_size):
+        flds = [fs[i] for i in range(start, min(start + batch_size, len(meta)))]
+        vals = []
+        for i, fld in enumerate(flds):
+            fld_meta = meta[start + i]
+            # smoothing only works for regular latlon grids
+            if fld_meta[0] == "regular_ll":
+                ncol = int(fld_meta[1])
+                vals.append(np.reshape(fld.values(), (-1, ncol)))
+            else:
+                raise ValueError(
+                    f"Unsupported gridType={fld_meta[0]} in field={start + i}. Only regular_ll is accepted!"
+                )
+
+        for i, (fld, val) in enumerate(zip(flds, executor.map_fields(func, vals))):
+            fld_meta = meta[start + i]
             r = fld.set_values(val.flatten())
             if fld_meta[2] is not None:
                 try:
@@ -260,10 +302,6 @@ def _smooth_core(fs, repeat, m_func, m_arg, **kwargs):
                 except:
                     pass
             res.append(r)
-        else:
-            raise ValueError(
-                f"Unsupported gridType={fld_meta[0]} in field={i}. Only regular_ll is accepted!"
-            )
 
     return res
 
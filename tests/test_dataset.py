@@ -70,10 +70,10 @@ def test_dataset():
     for comp in ["an", "oper"]:
         for f in [
             "datafiles.yaml",
-            "scalar.csv.gz",
-            "wind10m.csv.gz",
-            "wind.csv.gz",
-            "wind3d.csv.gz",
+            "scalar.idx.npz",
+            "wind10m.idx.npz",
+            "wind.idx.npz",
+            "wind3d.idx.npz",
         ]:
             assert os.path.exists(os.path.join(index_dir, comp, f))
 
@@ -188,6 +188,37 @@ def test_dataset():
     remove_dataset()
 
 
+def test_dataset_select_reads_selected_messages():
+    build_dataset()
+    try:
+        ds = mv.load_dataset(DS_DIR)
+        ds.scan()
+        ds = mv.load_dataset(DS_DIR)
+
+        db = ds["an"]
+        d = db.select(shortName="t", level=[500, 850])
+        assert isinstance(d, mv.Fieldset)
+        assert len(d) == 4
+        # only the selected messages were read, not the whole data files
+        assert db.fs == {}
+
+        ref = mv.read(os.path.join(DS_DIR, "data", "an", "t_pl.grib"))
+        ref = ref.select(shortName="t", level=[500, 850])
+        assert mv.grib_get(d, ["date:l", "level:l"]) == mv.grib_get(
+            ref, ["date:l", "level:l"]
+        )
+        assert mv.accumulate(mv.abs(d - ref)) == [0] * 4
+
+        v = db["wind850"]
+        assert mv.grib_get(v, ["shortName", "level:l"])[:2] == [
+            ["u", 850],
+            ["v", 850],
+        ]
+        assert db.fs == {}
+    finally:
+        remove_dataset()
+
+
 def test_dataset_create_template():
 
     global DS_DIR
@@ -16,14 +16,15 @@ from black import assert_equivalent
 import numpy as np
 import pandas as pd
 
-
 if "METVIEW_PYTHON_ONLY" not in os.environ:
     import metview as mv
 else:
     import metview.metviewpy as mv
 
+# the tests of the internals of the Python Fieldset always use it
+import metview.metviewpy as mvp
 from metview.metviewpy.param import ParamInfo
-from metview.metviewpy.indexer import GribIndexer
+from metview.metviewpy.indexer import GribIndexer, FieldsetIndexer
 
 PATH = os.path.dirname(__file__)
 
@@ -1480,3 +1481,419 @@ def test_deacc():
         for idx, steps in steps.items():
             v_ref = f[steps[0]].values() - f[steps[1]].values()
             np.testing.assert_allclose(r[idx].values(), v_ref, rtol=1e-03)
+
+
+def test_indexer_build_vector_index():
+    indexer = FieldsetIndexer(object())
+
+    # u, v, w components with duplicates and unmatched levels
+    comps = [
+        ("u", [500, 500, 850, 1000]),
+        ("v", [850, 500, 500, 300]),
+        ("w", [500, 850]),
+    ]
+    data = {k: [] for k in [*indexer.keys, "_msgIndex1"]}
+    for name, levels in comps:
+        for level in levels:
+            for k, v in GribIndexer.DEFAULT_KEYS.items():
+                data[k].append(v[2](0))
+            data["shortName"][-1] = name
+            data["level"][-1] = level
+            data["_msgIndex1"].append(len(data["_msgIndex1"]))
+    df = indexer._make_dataframe(data)
+
+    r = indexer._build_vector_index(df, "wind", ["u", "v"])
+    assert [x[-2:] for x in r] == [[0, 5], [1, 6], [2, 4]]
+    assert [x[0] for x in r] == ["wind"] * 3
+    assert [x[5] for x in r] == [500, 500, 850]
+
+    r = indexer._build_vector_index(df, "wind3d", ["u", "v", "w"])
+    assert [x[-3:] for x in r] == [[0, 5, 8], [2, 4, 9]]
+
+    assert indexer._build_vector_index(df, "wind10m", ["10u", "10v"]) == []
+
+
+def test_fieldset_select_mask_cache(monkeypatch):
+    from metview.metviewpy import indexdb
+    from metview.metviewpy.indexdb import MASK_CACHE
+
+    # the repeated selections must not be served by the select cache
+    monkeypatch.setattr(indexdb, "SELECT_CACHE_SIZE", 0)
+    f = mv.read(file_in_testdir("t_time_series.grib"))
+    MASK_CACHE.clear()
+
+    g = f.select(shortName="t", step=[9, 48])
+    assert mv.grib_get(g, ["shortName", "step"]) == [["t", "9"], ["t", "48"]]
+    hits = MASK_CACHE.hits
+    g = f.select(shortName="t", step=[9, 48])
+    assert len(g) == 2
+    assert MASK_CACHE.hits == hits + 2
+
+    # the datetime column is computed once
+    g = f.select(dateTime="2020-12-21 12:00")
+    assert len(g) == 10
+    g = f.select(dateTime=["2020-12-21 12:00", "2020-12-21 15:00"])
+    assert len(g) == 10
+    g = f.select(dateTime="2020-12-21 15:00")
+    assert len(g) == 0
+    assert MASK_CACHE.hits == hits + 4
+
+
+def test_fieldset_select_inverted_index(tmp_path):
+    from metview.metviewpy import indexdb
+    from metview.metviewpy.indexdb import IndexDb, InvertedIndex
+    from metview.metviewpy.indexer import ExperimentIndexer
+
+    f = mv.read(file_in_testdir("tuv_pl.grib"))
+    queries = [
+        {"shortName": "t"},
+        {"shortName": ["t", "v"], "level": [500, 850]},
+        {"shortName": "t", "level": 1},
+        {"typeOfLevel": "isobaricInhPa", "dateTime": "2016-09-25 00:00"},
+    ]
+    ref = [mv.grib_get(f.select(**q), ["shortName", "level"]) for q in queries]
+
+    indexdb.INVERTED_INDEX = True
+    try:
+        f = mv.read(file_in_testdir("tuv_pl.grib"))
+        for q, r in zip(queries, ref):
+            assert mv.grib_get(f.select(**q), ["shortName", "level"]) == r
+        assert list(f._db._inverted.keys()) == ["scalar"]
+
+        # persisted next to the block file
+        df = f._db.blocks["scalar"]
+        ExperimentIndexer._write_dataframe(None, df, "scalar", str(tmp_path))
+        db = IndexDb("test", db_dir=str(tmp_path))
+        df = ExperimentIndexer.read_dataframe("scalar", str(tmp_path))
+        db.blocks["scalar"] = df
+        dims = {"shortName": ["u"], "level": [300, 500]}
+        r = db._filter_df(df=df, dims=dims, key="scalar")
+        assert list(r["level"]) == [500, 300]
+        path = tmp_path / f"scalar{InvertedIndex.SUFFIX}"
+        assert path.exists()
+
+        db = IndexDb("test", db_dir=str(tmp_path))
+        idx = db._inverted_index("scalar", df)
+        assert idx.fingerprint == InvertedIndex.read(str(path), df).fingerprint
+        assert db._filter_df(df=df, dims=dims, key="scalar").equals(r)
+
+        # a changed block invalidates the stored index
+        ExperimentIndexer._write_dataframe(
+            None, df[df["level"] != 500], "scalar", str(tmp_path)
+        )
+        db = IndexDb("test", db_dir=str(tmp_path))
+        df = ExperimentIndexer.read_dataframe("scalar", str(tmp_path))
+        r = db._filter_df(df=df, dims=dims, key="scalar")
+        assert list(r["level"]) == [300]
+    finally:
+        indexdb.INVERTED_INDEX = False
+
+
+def test_index_storage(tmp_path, monkeypatch):
+    from metview.metviewpy.indexer import (
+        ExperimentIndexer,
+        INDEX_STORAGES,
+        index_storage,
+    )
+
+    f = mv.read(file_in_testdir("tuv_pl.grib"))
+    f.select(shortName="t")
+    df = f._db.blocks["scalar"]
+    # a missing value in a nullable and a string column
+    df.loc[1, "level"] = pd.NA
+    df.loc[2, "marsType"] = np.nan
+
+    csv = INDEX_STORAGES["csv"]
+    path = csv.path("scalar", str(tmp_path))
+    csv.write(df, path)
+    ref = csv.read(path)
+
+    # the legacy blocks are read without converting them
+    assert ExperimentIndexer.get_storage_key_list(str(tmp_path)) == ["scalar"]
+    r = ExperimentIndexer.read_dataframe("scalar", str(tmp_path))
+    assert r.equals(ref)
+    assert os.listdir(str(tmp_path)) == [os.path.basename(path)]
+
+    # nothing is migrated in a read-only directory
+    with monkeypatch.context() as m:
+        m.setattr(os, "access", lambda path, mode: False)
+        assert not ExperimentIndexer.migrate_storage(str(tmp_path))
+    assert os.listdir(str(tmp_path)) == [os.path.basename(path)]
+
+    # migration removes the csv file
+    assert ExperimentIndexer.migrate_storage(str(tmp_path))
+    assert not os.path.exists(path)
+    assert ExperimentIndexer.get_storage_key_list(str(tmp_path)) == ["scalar"]
+    assert os.path.exists(index_storage().path("scalar", str(tmp_path)))
+
+    r = ExperimentIndexer.read_dataframe("scalar", str(tmp_path))
+    assert r.equals(ref)
+    assert list(r.dtypes) == list(ref.dtypes)
+    assert r["level"].isna().tolist()[:3] == [False, True, False]
+    assert r["marsType"].isna().tolist()[:3] == [False, False, True]
+
+    # column projection
+    r = ExperimentIndexer.read_dataframe(
+        "scalar", str(tmp_path), columns=["level", "shortName"]
+    )
+    assert list(r.columns) == ["shortName", "level"]
+    assert r.equals(ref[["shortName", "level"]])
+
+
+def test_experiment_indexer_incremental_scan(tmp_path):
+    import shutil
+    import yaml
+    from metview.metviewpy.indexdb import IndexDb
+    from metview.metviewpy.indexer import ExperimentIndexer, index_storage
+
+    data_dir = tmp_path / "data"
+    shutil.copytree(file_in_testdir(os.path.join("ds", "an")), data_dir)
+
+    scanned = []
+
+    def scan(db_dir, incremental=True):
+        db = IndexDb(
+            "an", path=str(data_dir), file_name_pattern="*.grib", db_dir=str(db_dir)
+        )
+        scanned.clear()
+        ExperimentIndexer(db).scan(
+            incremental=incremental, progress=lambda n, total: scanned.append(n)
+        )
+        with open(db_dir / "datafiles.yaml", "r") as f:
+            files = yaml.safe_load(f)
+        return db.blocks, files
+
+    blocks, files = scan(tmp_path / "index")
+    assert len(scanned) == 8
+    blocks, _ = scan(tmp_path / "index")
+    assert scanned == []
+    assert set(blocks.keys()) == set(["scalar", "wind10m", "wind", "wind3d"])
+
+    # new, changed and deleted files
+    shutil.copy(file_in_testdir(os.path.join("ds", "oper", "tp_sfc.grib")), data_dir)
+    shutil.copy(file_in_testdir(os.path.join("ds", "oper", "t_pl.grib")), data_dir)
+    os.remove(data_dir / "msl_sfc.grib")
+    os.remove(data_dir / "w_pl.grib")
+
+    blocks, files = scan(tmp_path / "index")
+    assert len(scanned) == 2
+    ref_blocks, ref_files = scan(tmp_path / "index_full", incremental=False)
+    assert len(scanned) == 7
+    assert files == ref_files
+    assert set(blocks.keys()) == set(["scalar", "wind10m", "wind"])
+    assert not os.path.exists(index_storage().path("wind3d", str(tmp_path / "index")))
+    for k, df in ref_blocks.items():
+        assert blocks[k].equals(df), k
+        r = ExperimentIndexer.read_dataframe(k, str(tmp_path / "index"))
+        assert r.equals(df), k
+    assert "msl" not in blocks["scalar"]["shortName"].values
+    assert "tp" in blocks["scalar"]["shortName"].values
+
+
+def test_experiment_indexer_parallel_scan(tmp_path):
+    import yaml
+    from metview.metviewpy.indexdb import IndexDb
+    from metview.metviewpy.indexer import ExperimentIndexer
+
+    def scan(db_dir, workers):
+        db = IndexDb(
+            "oper",
+            path=file_in_testdir(os.path.join("ds", "oper")),
+            file_name_pattern="*.grib",
+            db_dir=str(db_dir),
+        )
+        counts = []
+        ExperimentIndexer(db).scan(
+            incremental=False,
+            workers=workers,
+            progress=lambda n, total: counts.append((n, total)),
+        )
+        with open(db_dir / "datafiles.yaml", "r") as f:
+            files = yaml.safe_load(f)
+        return db.blocks, files, counts
+
+    ref_blocks, ref_files, counts = scan(tmp_path / "serial", 1)
+    assert counts == [(i + 1, 9) for i in range(9)]
+    blocks, files, counts = scan(tmp_path / "parallel", 3)
+    assert counts == [(i + 1, 9) for i in range(9)]
+    assert files == ref_files
+    assert set(blocks.keys()) == set(ref_blocks.keys())
+    for k, df in ref_blocks.items():
+        assert blocks[k].equals(df), k
+
+
+def test_experiment_indexer_message_location(tmp_path):
+    import eccodes
+    from metview.metviewpy.indexdb import IndexDb
+    from metview.metviewpy.indexer import ExperimentIndexer
+
+    path = file_in_testdir(os.path.join("ds", "an"))
+    db = IndexDb("an", path=path, file_name_pattern="*.grib", db_dir=str(tmp_path))
+    ExperimentIndexer(db).scan()
+    df = db.blocks["wind"]
+    assert list(df.columns[-8:]) == [
+        "_msgIndex1",
+        "_fileIndex1",
+        "_offset1",
+        "_length1",
+        "_msgIndex2",
+        "_fileIndex2",
+        "_offset2",
+        "_length2",
+    ]
+    with open(os.path.join(path, "u_pl.grib"), "rb") as f:
+        data = f.read()
+    fs = mv.read(os.path.join(path, "u_pl.grib"))
+    df = db.blocks["scalar"]
+    df = df[df["shortName"] == "u"]
+    assert len(df) == len(fs)
+    cols = ["level", "_msgIndex1", "_offset1", "_length1"]
+    for level, msg_index, offset, length in df[cols].itertuples(index=False):
+        h = eccodes.codes_new_from_message(data[offset : offset + length])
+        try:
+            assert eccodes.codes_get_long(h, "level") == level
+            assert eccodes.codes_get_message_size(h) == length
+        finally:
+            eccodes.codes_release(h)
+        assert fs[int(msg_index)].grib_get_long("level") == level
+
+
+def test_fieldset_indexer_headers_only():
+    from metview.metviewpy import fieldset
+
+    ref = mvp.read(file_in_testdir("tuv_pl.grib"))
+    keys = GribIndexer.DEFAULT_ECC_KEYS
+    f = fieldset.Fieldset(path=file_in_testdir("tuv_pl.grib"), lazy_load=True)
+    assert f.grib_get_columns(keys, headers_only=True) == ref.grib_get_columns(keys)
+    assert all(x._handle is None for x in f.fields)
+
+    f = fieldset.Fieldset(path=file_in_testdir("tuv_pl.grib"), lazy_load=True)
+    g = f.select(shortName="t", level=[500, 850])
+    assert all(x._handle is None for x in f.fields)
+    assert mvp.grib_get(g, ["shortName", "level:l"]) == [["t", 850], ["t", 500]]
+
+
+def test_fieldset_db_add_keys(monkeypatch):
+    from metview.metviewpy.indexdb import FieldsetDb
+
+    keys = ["gridType", "expver"]
+    ref = FieldsetDb(fs=mv.read(file_in_testdir("tuv_pl.grib")))
+    ref.indexer.update_keys(keys)
+    ref.load(vector=True)
+
+    f = mv.read(file_in_testdir("tuv_pl.grib"))
+    db = FieldsetDb(fs=f)
+    db.load(vector=True)
+    assert "gridType" not in db.blocks["scalar"].columns
+
+    # the new columns are added without scanning the fieldset again
+    def _scan(*args, **kwargs):
+        assert False
+
+    monkeypatch.setattr(FieldsetIndexer, "_scan", _scan)
+    monkeypatch.setattr(FieldsetIndexer, "_scan_vector", _scan)
+    for k in keys:
+        db.load(keys=[k])
+    assert set(db.blocks.keys()) == set(ref.blocks.keys())
+    for k, df in ref.blocks.items():
+        assert db.blocks[k].equals(df), k
+
+    g = db.select(gridType="regular_ll", shortName="t", level=500)
+    assert mv.grib_get(g, ["shortName", "level:l"]) == [["t", 500]]
+
+
+def test_fieldset_select_cache():
+    f = mvp.read(file_in_testdir("tuv_pl.grib"))
+    g1 = f.select(shortName="t", level=[500, 850])
+    cache = f._db.select_cache
+    assert (cache.hits, cache.misses, len(cache)) == (0, 1, 1)
+
+    # a new Fieldset sharing the Fields is returned
+    g2 = f.select(level=[500, 850], shortName="t")
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert g2 is not g1
+    assert g2.fields == g1.fields
+    assert mvp.grib_get(g2, ["shortName", "level:l"]) == [["t", 850], ["t", 500]]
+    g2.append(f[0])
+    assert len(f.select(shortName="t", level=[500, 850])) == 2
+    assert cache.hit_rate == 2 / 3
+
+    # the conditions are compared once converted
+    assert len(f.select(shortName=["t"], level=["850", 500, 500])) == 2
+    assert (cache.hits, cache.misses, len(cache)) == (3, 1, 1)
+    for level in [500, [500], "500"]:
+        assert len(f.select(shortName="t", level=level)) == 1
+    assert (cache.hits, cache.misses, len(cache)) == (5, 2, 2)
+
+    g = f["u500"]
+    assert g._ds_param_info is not None
+    g = f["u500"]
+    assert cache.hits == 6
+    assert mvp.grib_get(g, ["shortName", "level:l"]) == [["u", 500]]
+
+    # adding a key replaces the blocks
+    assert len(f.select(shortName="t", gridType="regular_ll")) == 6
+    assert len(cache) == 1
+    assert len(f.select(shortName="t", level=[500, 850])) == 2
+    assert (cache.hits, cache.misses) == (6, 5)
+
+    cache.max_size = 0
+    assert len(f.select(shortName="t", level=[500, 850])) == 2
+    assert (cache.hits, cache.misses) == (6, 5)
+    assert len(cache) == 2
+    assert str(cache).startswith("SelectCache[size=2")
+
+
+def test_fieldset_db_extract_fields():
+    f = mvp.read(file_in_testdir("tuv_pl.grib"))
+    db = f._get_db()
+    db.load(vector=True)
+
+    # the components are taken row by row until max_count is reached
+    c, g = db._get_fields({"shortName": ["wind"]}, max_count=3, vector=True)
+    assert mvp.grib_get(g, ["shortName", "level:l"]) == [
+        ["u", 1000],
+        ["v", 1000],
+        ["u", 850],
+        ["v", 850],
+    ]
+    assert c.blocks["wind"][["_msgIndex1", "_msgIndex2"]].values.tolist() == [
+        [0, 1],
+        [2, 3],
+    ]
+    assert all(x is f.fields[i] for x, i in zip(g.fields, [1, 2, 4, 5]))
+
+    g = f.sort("level", ">")
+    assert g.grib_get_long("level") == sorted(f.grib_get_long("level"), reverse=True)
+    assert g._db.blocks["scalar"]["_msgIndex1"].tolist() == list(range(len(f)))
+    assert g.select(level=700).grib_get_string("shortName") == ["t", "u", "v"]
+
+
+def test_fieldset_db_take_fallback():
+    from metview.metviewpy.indexdb import FieldsetDb
+
+    class MacroFieldset:
+        # like the binary Fieldset any attribute is resolved to a function
+        def __init__(self, fields=None):
+            self.fields = [] if fields is None else fields
+
+        def __getattr__(self, name):
+            def call(*args, **kwargs):
+                raise AssertionError(f"{name} called")
+
+            return call
+
+        def __getitem__(self, index):
+            return MacroFieldset([self.fields[index]])
+
+        def __len__(self):
+            return len(self.fields)
+
+        def append(self, other):
+            self.fields = self.fields + other.fields
+
+    db = FieldsetDb(MacroFieldset(list("abcde")))
+    df = pd.DataFrame({"shortName": ["t"] * 3, "_msgIndex1": [4, 0, 2]})
+    df, fs = db._extract_scalar_fields(df)
+    assert fs.fields == ["e", "a", "c"]
+    assert df["_msgIndex1"].tolist() == [0, 1, 2]
@@ -7,10 +7,15 @@
 # granted to it by virtue of its status as an intergovernmental organisation
 # nor does it submit to any jurisdiction.
 
+import concurrent.futures
 from inspect import ArgInfo
 import numpy as np
 import os
+import pickle
 import pytest
+import shutil
+import tempfile
+import weakref
 
 import metview.metviewpy as mv
 from metview.metviewpy import utils
@@ -112,6 +117,197 @@ def test_fieldset_create_from_glob_paths():
     assert par_ref == f.grib_get(["shortName", "level"])
 
 
+def test_fieldset_lazy_load():
+    path = os.path.join(PATH, "tuv_pl.grib")
+    f = mv.Fieldset(path=path, lazy_load=True)
+    g = mv.Fieldset(path=path)
+    assert len(f) == 18
+    assert all(x._handle is None for x in f.fields)
+    assert f.grib_index() == g.grib_index()
+    assert all(x._handle is None for x in f.fields)
+    assert f.grib_get(["shortName", "level"]) == g.grib_get(["shortName", "level"])
+    np.testing.assert_allclose(f.values(), g.values())
+    np.testing.assert_allclose((f + 1).values(), g.values() + 1)
+
+
+def test_fieldset_lazy_load_handle_limit():
+    pool = mv.fieldset.HANDLE_POOL
+    max_handles = pool.max_handles
+    pool.max_handles = 3
+    try:
+        f = mv.Fieldset(path=os.path.join(PATH, "tuv_pl.grib"), lazy_load=True)
+        sn = f.grib_get_string("shortName")
+        assert sn == ["t", "u", "v"] * 6
+        assert sum(x._handle is not None for x in f.fields) == 3
+        assert len(pool) == 3
+        # cached key values do not need the handle
+        assert f[0].grib_get_string("shortName") == "t"
+        assert f.fields[0]._handle is None
+        # evicted handles are loaded again on demand
+        assert f[0].grib_get_long("level") == 1000
+        assert f.fields[0]._handle is not None
+        assert sum(x._handle is not None for x in f.fields) == 3
+        f = None
+        assert len(pool) == 0
+    finally:
+        pool.max_handles = max_handles
+
+
+def test_fieldset_sidecar():
+    sidecar_dir = mv.sidecar.SIDECAR_DIR
+    mv.sidecar.SIDECAR_DIR = tempfile.mkdtemp()
+    try:
+        path = os.path.join(PATH, "tuv_pl.grib")
+        g = mv.Fieldset(path=path)
+        f = mv.Fieldset(path=path, sidecar=True)
+        assert os.path.isfile(mv.sidecar.SidecarIndex.sidecar_path(path))
+        assert len(f) == 18
+        assert f.grib_index() == g.grib_index()
+
+        # reopen: the metadata comes from the sidecar, no handles are created
+        f = mv.Fieldset(path=path, sidecar=True)
+        r = f.select(shortName="u", level=[500, 850])
+        assert all(x._handle is None for x in f.fields)
+        assert r.grib_get_long("level") == [850, 500]
+        assert r.grib_get_string("shortName") == ["u", "u"]
+        assert all(x._handle is None for x in f.fields)
+        np.testing.assert_allclose(
+            r.values(), g.select(shortName="u", level=[500, 850]).values()
+        )
+        assert f.grib_get(["shortName", "centre"])[0] == ["t", "ecmf"]
+
+        # a modified file invalidates the sidecar
+        p = os.path.join(mv.sidecar.SIDECAR_DIR, "tuv_pl.grib")
+        shutil.copyfile(path, p)
+        assert len(mv.Fieldset(path=p, sidecar=True)) == 18
+        with open(p, "ab") as fout:
+            with open(os.path.join(PATH, "test.grib"), "rb") as fin:
+                fout.write(fin.read())
+        f = mv.Fieldset(path=p, sidecar=True)
+        assert len(f) == 19
+        assert f[18].grib_get_string("shortName") == "2t"
+    finally:
+        shutil.rmtree(mv.sidecar.SIDECAR_DIR)
+        mv.sidecar.SIDECAR_DIR = sidecar_dir
+
+
+def test_fieldset_lazy_load_mmap():
+    path = os.path.join(PATH, "tuv_pl.grib")
+    g = mv.Fieldset(path=path)
+    try:
+        for use_mmap in [False, True]:
+            mv.fieldset.READ_WITH_MMAP = use_mmap
+            f = mv.Fieldset(path=path, lazy_load=True)
+            np.testing.assert_allclose(f.values(), g.values())
+            assert [x.handle.offset for x in f.fields] == [x[1] for x in g.grib_index()]
+    finally:
+        mv.fieldset.READ_WITH_MMAP = True
+
+    m = mv.fieldset.MappedGribFile.get(path)
+    assert m is mv.fieldset.MappedGribFile.get(path)
+    h = m.handle(1440, 1440)
+    assert h.get_string("shortName") == "u"
+    assert h.path == path
+    assert h.offset == 1440
+
+
+def test_fieldset_from_refs():
+    path = os.path.join(PATH, "tuv_pl.grib")
+    g = mv.Fieldset(path=path)
+    refs = [
+        (path, offset, length)
+        for offset, length in mv.fieldset.GribFile.scan_offsets(path)
+    ]
+    f = mv.Fieldset.from_refs(refs[4:7])
+    assert all(x._handle is None for x in f.fields)
+    assert f.grib_get_long("level") == g[4:7].grib_get_long("level")
+
+    pool = mv.fieldset.FILE_POOL
+    max_files = pool.max_files
+    pool.clear()
+    pool.max_files = 1
+    tmp = tempfile.mkdtemp()
+    try:
+        mv.fieldset.READ_WITH_MMAP = False
+        p = os.path.join(tmp, "tuv_pl.grib")
+        shutil.copyfile(path, p)
+        f = mv.Fieldset.from_refs([(p, *refs[1][1:]), (path, *refs[2][1:])])
+        np.testing.assert_allclose(f.values(), g[1:3].values())
+        assert len(pool) == 1
+        # a changed file is opened again
+        with open(p, "wb") as fout:
+            with open(path, "rb") as fin:
+                fout.write(fin.read()[refs[2][1] :])
+        f = mv.Fieldset.from_refs([(p, 0, refs[2][2])])
+        np.testing.assert_allclose(f.values(), g[2].values())
+    finally:
+        mv.fieldset.READ_WITH_MMAP = True
+        pool.clear()
+        pool.max_files = max_files
+        shutil.rmtree(tmp)
+
+
+def test_fieldset_take():
+    f = mv.Fieldset(path=os.path.join(PATH, "tuv_pl.grib"))
+    idx = np.array([5, 0, 5, 17])
+    r = f.take(idx)
+    assert len(r) == 4
+    assert all(r.fields[i] is f.fields[j] for i, j in enumerate(idx))
+    assert r.grib_get_long("level") == f[idx].grib_get_long("level")
+    assert len(f.take([])) == 0
+    with pytest.raises(IndexError):
+        f.take([18])
+    with pytest.raises(ValueError):
+        f.take([[0, 1]])
+
+    # boolean masks select the fields where they are True
+    mask = np.zeros(18, dtype=bool)
+    mask[[2, 7]] = True
+    r = f[mask]
+    assert len(r) == 2
+    assert r.fields == [f.fields[2], f.fields[7]]
+    with pytest.raises(IndexError):
+        f.take(mask[:5])
+
+    # non-integer indices are not truncated
+    with pytest.raises(TypeError):
+        f[np.array([1.7])]
+    with pytest.raises(TypeError):
+        f.take(["1"])
+
+
+def test_iter_fields():
+    path = os.path.join(PATH, "tuv_pl.grib")
+    f = mv.Fieldset(path=path)
+
+    r = list(mv.iter_fields(path))
+    assert len(r) == 18
+    for x, y in zip(r, f.fields):
+        assert x.grib_index() == y.grib_index()
+        np.testing.assert_array_equal(x.values(), y.values())
+
+    sel = {"shortName": "t", "level": [500, 850]}
+    r = list(mv.iter_fields([path, path], select=sel))
+    assert len(r) == 4
+    g = f.select(**sel)
+    assert [x.grib_index() for x in r] == g.grib_index() * 2
+    # the filter keys are cached from the header
+    assert r[0].meta["shortName:s"] == "t"
+    assert r[0].meta["level:l"] == 850
+
+    r = list(mv.iter_fields(path, select={"shortName": ["u", "v"]}, batch=5))
+    assert [len(x) for x in r] == [5, 5, 2]
+    assert r[2].grib_get_string("shortName") == ["u", "v"]
+
+    assert list(mv.iter_fields(path, select={"level": 1})) == []
+
+    # the fields are not kept alive by the iterator
+    it = mv.iter_fields(path)
+    ref = weakref.ref(next(it))
+    next(it)
+    assert ref() is None
+
+
 def test_read_1():
     f = mv.read(os.path.join(PATH, "test.grib"))
     assert type(f) is mv.Fieldset
@@ -246,6 +442,72 @@ def test_grib_get_generic_key_not_exist():
         kv = a.grib_get_long(["silly"])
 
 
+def test_grib_get_columns():
+    f = mv.Fieldset(path=os.path.join(PATH, "tuv_pl.grib"))[0:4]
+    keys = ["shortName", "level:l", "level:d", "silly:l", "centre:n"]
+    r = f.grib_get_columns(keys)
+    assert r["shortName"] == ["t", "u", "v", "t"]
+    assert r["level:l"] == [1000, 1000, 1000, 850]
+    assert r["silly:l"] == [None] * 4
+    assert r["centre:n"] == ["ecmf"] * 4
+
+    r = f.grib_get_columns(keys, as_numpy=True)
+    assert r["level:l"].dtype == np.int64
+    np.testing.assert_array_equal(r["level:l"], [1000, 1000, 1000, 850])
+    assert r["level:d"].dtype == np.float64
+    assert r["silly:l"].dtype == object
+    assert list(r["shortName"]) == ["t", "u", "v", "t"]
+
+    # header only reading of a file
+    reader = mv.metadata.reader(keys)
+    assert mv.metadata.reader(keys) is reader
+    offsets, lengths, cols = reader.read_file(os.path.join(PATH, "tuv_pl.grib"))
+    assert len(offsets) == 18
+    assert [x[1] for x in f.grib_index()] == offsets[:4]
+    assert cols["shortName"] == ["t", "u", "v"] * 6
+    assert cols["level:l"][:4] == [1000, 1000, 1000, 850]
+
+    with pytest.raises(ValueError):
+        mv.metadata.MetadataReader(["level:silly"])
+
+
+def test_metadata_cache():
+    f = mv.Fieldset(path=os.path.join(PATH, "tuv_pl.grib"))[0:2]
+    stats = mv.metadata.CACHE_STATS
+    stats.reset()
+    assert f.grib_get_long("level") == [1000, 1000]
+    assert (stats.hits, stats.misses) == (0, 2)
+    assert f.grib_get_long("level") == [1000, 1000]
+    assert f.grib_get(["level:l", "shortName"]) == [[1000, "t"], [1000, "u"]]
+    assert (stats.hits, stats.misses) == (4, 4)
+
+    # missing keys are cached but the typed getters still raise
+    assert f.grib_get(["silly:l"]) == [[None], [None]]
+    assert f.grib_get(["silly:l"]) == [[None], [None]]
+    with pytest.raises(Exception):
+        f.grib_get_long("silly")
+
+    # arrays are not cached
+    f.grib_get_double_array("latitudes")
+    assert "latitudes:da" not in f.fields[0].meta
+
+    # modified fields have their own cache
+    g = f.grib_set_long(["level", 500])
+    assert g.grib_get_long("level") == [500, 500]
+    assert f.grib_get_long("level") == [1000, 1000]
+    g = f + 1
+    assert g.fields[0].meta == {}
+    assert g.grib_get_long("level") == [1000, 1000]
+
+    try:
+        mv.fieldset.METADATA_CACHE = False
+        g = mv.Fieldset(path=os.path.join(PATH, "tuv_pl.grib"))[0:2]
+        g.grib_get_long("level")
+        assert g.fields[0].meta == {}
+    finally:
+        mv.fieldset.METADATA_CACHE = True
+
+
 def test_values_1():
     f = mv.Fieldset(path=os.path.join(PATH, "test.grib"))
     v = f.values()
@@ -286,6 +548,55 @@ def test_values_with_missing():
     assert np.isclose(v[2663], 240.5642, eps)
 
 
+def test_values_dtype_and_out():
+    f = mv.Fieldset(path=os.path.join(PATH, "tuv_pl.grib"))
+    ref = f.values()
+
+    v = f.values(dtype=np.float32)
+    assert v.dtype == np.float32
+    assert v.shape == (18, 2664)
+    np.testing.assert_allclose(v, ref, rtol=1e-6)
+
+    v = f[0].values(dtype=np.float32)
+    assert v.shape == (2664,)
+    assert v.dtype == np.float32
+
+    # missing values in float32
+    g = mv.Fieldset(path=os.path.join(PATH, "t_with_missing.grib"))
+    v = g.values(dtype=np.float32)
+    assert np.isnan(v[798])
+    np.testing.assert_allclose(v, g.values(), rtol=1e-6)
+
+    # decode into a memory-mapped array
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        out = np.memmap(
+            os.path.join(tmp_dir, "values.dat"),
+            dtype=np.float32,
+            mode="w+",
+            shape=(18, 2664),
+        )
+        v = f.values(out=out)
+        assert v is out
+        np.testing.assert_allclose(out, ref, rtol=1e-6)
+        del v, out
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    out = np.zeros((18, 2664))
+    try:
+        mv.executor.set_executor(kind="thread", max_workers=2)
+        assert f.values(out=out) is out
+        np.testing.assert_array_equal(out, ref)
+    finally:
+        mv.executor.set_executor()
+
+    with pytest.raises(ValueError):
+        f.values(out=np.zeros((2, 2664)))
+    with pytest.raises(ValueError):
+        f.merge(mv.Fieldset(path=os.path.join(PATH, "test.grib"))).values()
+
+
 def test_grib_set_string():
     f = mv.Fieldset(path=os.path.join(PATH, "tuv_pl.grib"))[0:2]
     g = f.grib_set_string(["pressureUnits", "silly"])
@@ -400,6 +711,87 @@ def test_write_modified_fieldset_unop():
     os.remove(temp_path)
 
 
+def test_write_raw_copy(monkeypatch):
+    src = os.path.join(PATH, "tuv_pl.grib")
+    with open(src, "rb") as f:
+        data = f.read()
+    messages = [
+        data[offset : offset + length]
+        for offset, length in mv.fieldset.GribFile.scan_offsets(src)
+    ]
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        temp_path = os.path.join(tmp_dir, "written.grib")
+        for lazy_load in [False, True]:
+            f = mv.Fieldset(path=src, lazy_load=lazy_load)
+            # contiguous and non-contiguous runs mixed with a modified field
+            g = f[np.array([0, 1, 2, 5, 6, 3])]
+            g.append((f[4] + 1)[0])
+            g.write(temp_path)
+            with open(temp_path, "rb") as fin:
+                out = fin.read()
+            expected = b"".join(messages[i] for i in [0, 1, 2, 5, 6, 3])
+            assert out[: len(expected)] == expected
+            # the fields now refer to the written file
+            assert g[3].grib_index() == [(temp_path, len(b"".join(messages[0:3])))]
+            r = mv.Fieldset(path=temp_path)
+            assert len(r) == 7
+            np.testing.assert_allclose(r[6].values(), f[4].values() + 1, rtol=1e-5)
+
+        # the messages are padded in this file
+        padded = os.path.join(PATH, "t_time_series.grib")
+        for lazy_load in [False, True]:
+            f = mv.Fieldset(path=padded, lazy_load=lazy_load)
+            f[1:4].write(temp_path)
+            r = mv.Fieldset(path=temp_path)
+            assert len(r) == 3
+            assert r.grib_get_long("date") == f[1:4].grib_get_long("date")
+            np.testing.assert_array_equal(r.values(), f[1:4].values())
+
+        # overwriting the source file
+        shutil.copy(src, temp_path)
+        f = mv.Fieldset(path=temp_path, lazy_load=True)
+        f[::-1].write(temp_path)
+        with open(temp_path, "rb") as fin:
+            assert fin.read() == b"".join(messages[::-1])
+
+        # the eagerly read fields are encoded when their file changed
+        src_copy = os.path.join(tmp_dir, "source.grib")
+        out_path = os.path.join(tmp_dir, "out.grib")
+        g_ref = mv.Fieldset(path=src).values()
+        shutil.copy(src, src_copy)
+        f = mv.Fieldset(path=src_copy)
+        os.remove(src_copy)
+        f.write(out_path)
+        np.testing.assert_array_equal(mv.Fieldset(path=out_path).values(), g_ref)
+        shutil.copy(src, src_copy)
+        f = mv.Fieldset(path=src_copy)
+        with open(src_copy, "wb") as fout:
+            fout.write(b"".join(messages[::-1]))
+        f.write(out_path)
+        np.testing.assert_array_equal(mv.Fieldset(path=out_path).values(), g_ref)
+        # the other fields of f are not in the file written over their source
+        shutil.copy(src, src_copy)
+        f = mv.Fieldset(path=src_copy)
+        f[0:2].write(src_copy)
+        f.write(out_path)
+        r = mv.Fieldset(path=out_path)
+        assert len(r) == 18
+        np.testing.assert_array_equal(r.values(), g_ref)
+        # the written fields are copied from their new file
+        assert f[0].fields[0].source() == (out_path, 0, len(messages[0]))
+
+        # without copy_file_range
+        monkeypatch.delattr(os, "copy_file_range", raising=False)
+        monkeypatch.setattr(mv.fieldset, "COPY_BUFFER_SIZE", 1000)
+        mv.Fieldset(path=src)[1:5].write(temp_path)
+        with open(temp_path, "rb") as fin:
+            assert fin.read() == b"".join(messages[1:5])
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
 def test_field_func():
     def sqr_func(x):
         return x * x
@@ -824,6 +1216,164 @@ def test_field_maths_funcs():
     np.testing.assert_allclose(r.values(), np.mod(v, v1), rtol=1e-04)
 
 
+def test_lazy_evaluation():
+    f = mv.Fieldset(path=os.path.join(PATH, "tuv_pl.grib"))
+    u = f.select(shortName="u")
+    v = f.select(shortName="v")
+    u0 = u * 0.5
+    v0 = v * 0.5
+    ref = mv.sqrt((u - u0) ** 2 + (v - v0) ** 2)
+
+    with mv.fieldset.lazy_evaluation():
+        r = mv.sqrt((u - u0) ** 2 + (v - v0) ** 2)
+        assert r.temporary is None
+        assert all(x.expr is not None and x._handle is None for x in r.fields)
+        np.testing.assert_allclose(r.values(), ref.values(), atol=1e-4)
+        assert all(x._handle is None for x in r.fields)
+
+        # shared sub-expressions and operators modifying their input
+        a = u - 1
+        b = mv.bitmap(a * a + a, 0)
+        np.testing.assert_allclose(
+            b.values(), (u.values() - 1) ** 2 + u.values() - 1, rtol=1e-5
+        )
+        np.testing.assert_allclose(a.values(), u.values() - 1, rtol=1e-5)
+
+        # long chains do not hit the recursion limit
+        c = u
+        for _ in range(2000):
+            c = c + 1
+        np.testing.assert_allclose(c.values(), u.values() + 2000, rtol=1e-5)
+
+    assert not mv.fieldset.LAZY_EVALUATION
+
+    # the metadata is taken from the first operand and the values are
+    # only encoded when needed
+    assert r.grib_get_string("shortName") == ["u"] * 6
+    assert r.fields[0]._handle is not None
+    temp_path = "written_lazy.grib"
+    r.write(temp_path)
+    g = mv.Fieldset(path=temp_path)
+    np.testing.assert_allclose(g.values(), ref.values(), atol=1e-4)
+    g = None
+    os.remove(temp_path)
+
+
+def test_memory_results():
+    f = mv.Fieldset(path=os.path.join(PATH, "tuv_pl.grib"))
+    ref = mv.sqrt(f * 2 + 1)
+    mv.fieldset.MEMORY_RESULTS = True
+    try:
+        r = mv.sqrt(f * 2 + 1)
+        assert r.temporary is None
+        assert all(x.vals is not None for x in r.fields)
+        assert r.grib_index()[0] == (None, None)
+        # the values are packed as in the results written to disk
+        np.testing.assert_array_equal(r.values(), ref.values())
+        g = mv.bitmap(r, r[0].values()[0])
+        np.testing.assert_allclose(r.values(), ref.values(), rtol=1e-5)
+
+        # exceeding the limit spills the oldest results into a temporary file
+        mem = mv.fieldset.RESULT_MEMORY
+        max_memory = mem.max_memory
+        in_memory = (f + 1).values()
+        mem.max_memory = 20 * (2664 * 8 + 10000)
+        try:
+            r = f + 1
+            assert len(mem) < len(r)
+            spilled = [x for x in r.fields if x.ref is not None]
+            assert len(spilled) > 0
+            assert all(x._handle is None and x.vals is None for x in spilled)
+            assert is_temp_file(spilled[0].grib_index()[0])
+            np.testing.assert_allclose(r.values(), f.values() + 1, rtol=1e-5)
+            np.testing.assert_array_equal(r.values(), in_memory)
+        finally:
+            mem.max_memory = max_memory
+
+        temp_path = "written_memory_results.grib"
+        r.write(temp_path)
+        np.testing.assert_allclose(
+            mv.Fieldset(path=temp_path).values(), f.values() + 1, rtol=1e-5
+        )
+        os.remove(temp_path)
+    finally:
+        mv.fieldset.MEMORY_RESULTS = False
+
+
+def test_executor():
+    f = mv.Fieldset(path=os.path.join(PATH, "tuv_pl.grib"))
+    ref_add = (f + 1).values()
+    ref_ff = (f * f).values()
+    ref_sp = f.select(shortName="u").speed(f.select(shortName="v")).values()
+    ref_lat = f.coslat().values()
+    try:
+        for kind in ["thread", "process"]:
+            e = mv.executor.set_executor(kind=kind, max_workers=3, chunk_size=4)
+            assert e is mv.executor.EXECUTOR
+            np.testing.assert_allclose((f + 1).values(), ref_add)
+            np.testing.assert_allclose((f * f).values(), ref_ff)
+            sp = f.select(shortName="u").speed(f.select(shortName="v"))
+            assert sp.grib_get_long("paramId") == [10] * 6
+            np.testing.assert_allclose(sp.values(), ref_sp)
+            np.testing.assert_allclose(f.coslat().values(), ref_lat)
+    finally:
+        mv.executor.set_executor()
+
+    assert mv.executor.EXECUTOR.kind == "serial"
+    with pytest.raises(ValueError):
+        mv.executor.set_executor(kind="silly")
+
+
+def test_pickle():
+    for lazy_load in [False, True]:
+        f = mv.Fieldset(path=os.path.join(PATH, "tuv_pl.grib"), lazy_load=lazy_load)
+        g = f + 1
+        for protocol in [4, 5]:
+            for fs in [f, g]:
+                r = pickle.loads(pickle.dumps(fs, protocol=protocol))
+                assert type(r) == mv.Fieldset
+                assert len(r) == 18
+                assert r.temporary is None
+                assert r.grib_get_string("shortName") == ["t", "u", "v"] * 6
+                np.testing.assert_array_equal(r.values(), fs.values())
+
+        # with protocol 5 the messages are out-of-band buffers
+        buffers = []
+        data = pickle.dumps(f, protocol=5, buffer_callback=buffers.append)
+        assert len(buffers) == 18
+        assert len(data) < sum(len(b.raw()) for b in buffers)
+        r = pickle.loads(data, buffers=buffers)
+        np.testing.assert_array_equal(r.values(), f.values())
+
+    # references to the messages
+    f = mv.Fieldset(path=os.path.join(PATH, "tuv_pl.grib"), lazy_load=True)
+    g = f + 1
+    try:
+        mv.fieldset.PICKLE_BY_REFERENCE = True
+        data = pickle.dumps(f, protocol=5)
+        assert len(data) < 5000
+        r = pickle.loads(data)
+        assert r.fields[3].ref == f.fields[3].ref
+        np.testing.assert_array_equal(r.values(), f.values())
+        # temporary results are always sent as messages
+        r = pickle.loads(pickle.dumps(g, protocol=5))
+        assert r.fields[0].ref is None
+        np.testing.assert_array_equal(r.values(), g.values())
+        # eagerly read fields from a file with padded messages
+        f = mv.Fieldset(path=os.path.join(PATH, "t_time_series.grib"))
+        r = pickle.loads(pickle.dumps(f[1:4], protocol=5))
+        assert r.fields[0].ref == f.fields[1].source()
+        assert r.grib_get_long("date") == f[1:4].grib_get_long("date")
+        np.testing.assert_array_equal(r.values(), f[1:4].values())
+    finally:
+        mv.fieldset.PICKLE_BY_REFERENCE = False
+
+    # a fieldset can be sent to a worker process
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1) as pool:
+        r = pool.submit(mv.Fieldset.values, f).result()
+    np.testing.assert_array_equal(r, f.values())
+
+
 def test_str():
     f = mv.Fieldset(path=os.path.join(PATH, "tuv_pl.grib"))
     assert str(f) == "Fieldset (18 fields)"
@@ -1133,6 +1683,47 @@ def test_tanlat():
         )
 
 
+def test_geometry_cache():
+    fs = mv.Fieldset(path=os.path.join(PATH, "tuv_pl.grib"))
+    cache = mv.geometry.GEOMETRY_CACHE
+    cache.clear()
+
+    # all the fields share one geometry
+    g = fs.fields[0].geometry()
+    assert all(f.geometry() is g for f in fs.fields)
+    assert len(cache) == 1
+    with pytest.raises(ValueError):
+        g.latitudes[0] = 0
+    assert g.coslat is g.coslat
+    np.testing.assert_allclose(g.coslat, np.cos(np.deg2rad(fs[0].latitudes())))
+
+    # the Field returns a copy
+    lat = fs[0].latitudes()
+    lat[0] = -1
+    assert g.latitudes[0] != -1
+
+    fs2 = mv.Fieldset(path=os.path.join(PATH, "t1000_LL_2x2.grb"))
+    assert fs2.fields[0].geometry() is not g
+    assert len(cache) == 2
+
+    # eviction
+    try:
+        cache.max_grids = 1
+        fs3 = mv.Fieldset(path=os.path.join(PATH, "t1000_LL_7x7.grb"))
+        g3 = fs3.fields[0].geometry()
+        assert len(cache) == 1
+        assert fs3.fields[0].geometry() is g3
+    finally:
+        cache.max_grids = 16
+
+    # the grid cell areas add up to the surface of the Earth
+    r = fs2.grid_cell_area()
+    assert len(r) == 1
+    np.testing.assert_allclose(
+        r.values().sum(), 4 * np.pi * mv.geometry.EARTH_RADIUS**2, rtol=1e-5
+    )
+
+
 def test_stdev():
     fs = mv.Fieldset(path=os.path.join(PATH, "t1000_LL_7x7.grb"))
 
@@ -1207,6 +1798,69 @@ def test_var():
     np.testing.assert_allclose(r.values(), v_ref, rtol=1e-03)
 
 
+def test_min_max_percentile():
+    fs = mv.Fieldset(path=os.path.join(PATH, "monthly_avg.grib"))
+    v = np.array([x.values() for x in fs])
+
+    r = mv.min(fs)
+    assert len(r) == 1
+    np.testing.assert_allclose(r.values(), v.min(axis=0), rtol=1e-05)
+
+    r = mv.max(fs)
+    assert len(r) == 1
+    np.testing.assert_allclose(r.values(), v.max(axis=0), rtol=1e-05)
+
+    r = fs.percentile(50)
+    assert len(r) == 1
+    np.testing.assert_allclose(r.values(), np.median(v, axis=0), rtol=1e-05)
+
+    for p in [[10, 90], (10, 90), np.array([10, 90])]:
+        r = fs.percentile(p)
+        assert len(r) == 2
+        np.testing.assert_allclose(
+            r.values(), np.percentile(v, [10, 90], axis=0), rtol=1e-05
+        )
+
+    r = fs.percentile(np.float64(50))
+    assert len(r) == 1
+
+
+def test_reduction_stability():
+    fs = mv.Fieldset(path=os.path.join(PATH, "t1000_LL_7x7.grb"))
+    mv.fieldset.MEMORY_RESULTS = True
+    try:
+        # large offset with a small spread: E[x^2]-E[x]^2 would be useless here.
+        # The constant fields are packed into a float32 reference value, which
+        # represents these values exactly.
+        f = fs * 0 + 1e7
+        f = f.merge(f + 1).merge(f + 2)
+        vals = [x.values().copy() for x in f]
+        for chunk_size in [1, 2, 8]:
+            mv.reduction.REDUCTION_CHUNK_SIZE = chunk_size
+            np.testing.assert_allclose(f.var().values(), 2.0 / 3.0, rtol=1e-5)
+            np.testing.assert_allclose(
+                f.stdev().values(), np.sqrt(2.0 / 3.0), rtol=1e-5
+            )
+            np.testing.assert_allclose(f.mean().values(), 1e7 + 1, rtol=1e-9)
+        # the cached values of the fields are not modified
+        for x, v in zip(f, vals):
+            np.testing.assert_array_equal(x.values(), v)
+    finally:
+        mv.reduction.REDUCTION_CHUNK_SIZE = 8
+        mv.fieldset.MEMORY_RESULTS = False
+
+    f = fs.merge(2 * fs).merge(3 * fs).merge(4 * fs).merge(5 * fs)
+    ref = [x.values() for x in [f.mean(), f.var(), f.rms(), f.sum()]]
+    try:
+        mv.executor.set_executor(kind="thread", max_workers=2)
+        mv.reduction.REDUCTION_CHUNK_SIZE = 2
+        for x, r in zip([f.mean(), f.var(), f.rms(), f.sum()], ref):
+            np.testing.assert_allclose(x.values(), r, rtol=1e-5)
+    finally:
+        mv.reduction.REDUCTION_CHUNK_SIZE = 8
+        mv.executor.set_executor()
+
+
 def test_date():
 
     fs = mv.Fieldset(path=os.path.join(PATH, "monthly_avg.grib"))